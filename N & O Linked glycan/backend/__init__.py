@@ -1,4 +1,8 @@
-from .supersearch_search import all_supersearch_list_data
-from .protein_details import get_all_protein_data
-from .glycan_detail import get_glycan_data
-from .amino_acid_sites import sites_data
\ No newline at end of file
+from .pipeline import run_pipeline
+from .supersearch_search import PAGE_SIZE, LIST_WORKERS
+from .fetch_engine import HOST_CONCURRENCY, HOST_RATE_LIMIT
+from .amino_acid_sites import sites_data
+from .http_client import configure_response_cache, configure_url_overrides, parse_url_override, HTTP_CACHE_TTL
+from .output_format import OUTPUT_FORMATS, PARTITION_COLUMNS
+from .features import FEATURE_WINDOW
+from .sampling import NegativeSampling, parse_sample_ratios, SAMPLE_SEED
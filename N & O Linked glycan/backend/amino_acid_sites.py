@@ -1,54 +1,118 @@
-import requests
-import pandas as pd
 import re
-from functools import reduce
 import time
-import random
 import os
-import logging
-import json
-from csv import DictReader, DictWriter
-
-def get_positions_excluding_sites(fasta_seq, df, protein_accession):
-    # Get the specific sites to exclude
-    sites_to_exclude = df.loc[df.uniprotkb_canonical_ac == protein_accession, 'site'].astype(int).values
-    
-    # Find all motifs "NXSX" or "NXTX" where X is not P
-    motif_pattern = re.compile(r'N[^P](S|T)[^P]')
-    motifs = [(m.start(), m.group()) for m in motif_pattern.finditer(fasta_seq)]
-    
-    # Find positions of 'S' excluding specific sites and those in motifs
-    s_res = [m.start() for m in re.finditer('S', fasta_seq) if (m.start() + 1) not in sites_to_exclude and not any(m.start() in range(pos, pos + 4) for pos, _ in motifs)]
-    
-    # Find positions of 'T' excluding specific sites and those in motifs
-    t_res = [m.start() for m in re.finditer('T', fasta_seq) if (m.start() + 1) not in sites_to_exclude and not any(m.start() in range(pos, pos + 4) for pos, _ in motifs)]
-    
-    # Find positions of 'Y' excluding specific sites and those in motifs
-    y_res = [m.start() for m in re.finditer('Y', fasta_seq) if (m.start() + 1) not in sites_to_exclude and not any(m.start() in range(pos, pos + 4) for pos, _ in motifs)]
-    
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .protein_cache import ProteinCache
+from .domains import base_accession, build_domain_index, resolve_domains
+from .sampling import merge_counts
+from .journal import truncate_file, SITE_CHECKPOINT_PROTEINS
+from .metrics import metrics
+from .dataset import OUTPUT_PATH, WRITE_BUFFER_SIZE, BufferedRowWriter, unknown_site_template, unknown_site_row
+
+# N-glycosylation sequon "NXSX" or "NXTX" where X is not P
+MOTIF_PATTERN = re.compile(r'N[^P](S|T)[^P]')
+CANDIDATE_PATTERN = re.compile(r'[STY]')
+MOTIF_LENGTH = 4
+
+SHARD_DIR = "./output/site_shards"
+SHARDS_PER_WORKER = 4
+
+
+def scan_candidate_sites(fasta_seq, sites_to_exclude, min_distance=0, keep_probability=None, rng=None):
+    # Single pass over the sequence: sequon coverage goes into a bitmap and the
+    # known sites into a set, so each S/T/Y residue is checked in O(1).
+    # With min_distance, residues closer than that to a known site are dropped; with
+    # keep_probability (residue key -> probability, "N" for sequons) candidates are
+    # sampled here, before any row is built for them
+    excluded = {int(site) - 1 for site in sites_to_exclude}
+    near = None
+    if min_distance > 1:
+        near = bytearray(len(fasta_seq))
+        for pos in excluded:
+            start = max(0, pos - min_distance + 1)
+            end = min(len(fasta_seq), pos + min_distance)
+            if start < end:
+                near[start:end] = b"\x01" * (end - start)
+
+    def sampled_out(residue):
+        p = keep_probability.get(residue, 1.0) if keep_probability else 1.0
+        return p < 1.0 and rng.random() >= p
+
+    motifs = []
+    covered = bytearray(len(fasta_seq))
+    for m in MOTIF_PATTERN.finditer(fasta_seq):
+        pos = m.start()
+        covered[pos:pos + MOTIF_LENGTH] = b"\x01" * MOTIF_LENGTH
+        if (near is not None and near[pos]) or sampled_out("N"):
+            continue
+        motifs.append((pos, m.group()))
+
+    s_res, t_res, y_res = [], [], []
+    residue_lists = {'S': s_res, 'T': t_res, 'Y': y_res}
+    for m in CANDIDATE_PATTERN.finditer(fasta_seq):
+        pos = m.start()
+        if covered[pos] or pos in excluded or (near is not None and near[pos]):
+            continue
+        residue = m.group()
+        if sampled_out(residue):
+            continue
+        residue_lists[residue].append(pos)
+
     return s_res, t_res, y_res, motifs
 
-def sites_data(logger, df):
-    # Get unique uniprotkb_canonical_ac values
-    unique_ac = df['uniprotkb_canonical_ac'].unique()
-    unique_ac_list = unique_ac.tolist()
-    print(len(unique_ac_list))
+def add_known_site(known_sites, protein_accession, site, protein_name, tax_id):
+    # accession -> known sites, name and tax id
+    # (name and tax id are taken from the first row of the accession, in table order)
+    entry = known_sites.get(protein_accession)
+    if entry is None:
+        entry = known_sites[protein_accession] = {
+            "sites": set(),
+            "protein_name": protein_name,
+            "taxonomy_id": str(tax_id),
+        }
+    entry["sites"].add(int(site))
+
+def count_candidate_sites(known_items, cache, sampling):
+    # Counting pass of the sampler: candidates left after the distance filter, and known
+    # sites, per stratum. Proteins missing from the cache are not counted
+    candidate_counts, known_counts = Counter(), Counter()
+    for protein_accession, known in known_items:
+        target_data = cache.get(protein_accession)
+        if target_data is None:
+            continue
+        stratum = sampling.stratum(target_data['organism'])
+        s_res, t_res, y_res, motifs = scan_candidate_sites(target_data['fasta_seq'], known["sites"], sampling.min_distance)
+        for residue, candidates in (("S", s_res), ("T", t_res), ("Y", y_res), ("N", motifs)):
+            candidate_counts[(stratum, residue)] += len(candidates)
+        known_counts[stratum] += len(known["sites"])
+    return candidate_counts, known_counts
 
-    # Load the cache from the JSON file
-    with open("./output/cache.json", "r") as cache_file:
-        cache = json.load(cache_file)
+def count_candidate_shard(known_items, sampling):
+    # Runs in a worker process, like write_site_shard
+    cache = ProteinCache()
+    counts = count_candidate_sites(known_items, cache, sampling)
+    cache.close()
+    return counts
 
+def write_unknown_sites(known_items, writer, cache, logger=None, sampling=None):
+    # Returns the number of proteins skipped because they are missing from the cache
     count = 1
+    missing = 0
     start_time = time.time()
 
-    for protein_accession in unique_ac_list:
-        if count % 1000 == 0:
+    for protein_accession, known in known_items:
+        if logger and count % 1000 == 0:
             logger.info("elapse time " + str(time.time() - start_time))
             logger.info("Hit checkpoint at index " + str(count))
             logger.info("============================================")
             start_time = time.time()
             
-        target_data = cache[protein_accession]
+        target_data = cache.get(protein_accession)
+        if target_data is None:
+            missing += 1
+            continue
         fasta_seq = target_data['fasta_seq']
         gene_name = target_data['gene_name']
         organism = target_data['organism']
@@ -56,134 +120,133 @@ def sites_data(logger, df):
         molecular_function = target_data['molecular_function']
         cellular_component = target_data['cellular_component']
 
-        s_res, t_res, y_res, motifs = get_positions_excluding_sites(fasta_seq, df, protein_accession)
+        if sampling is None:
+            s_res, t_res, y_res, motifs = scan_candidate_sites(fasta_seq, known["sites"])
+        else:
+            s_res, t_res, y_res, motifs = scan_candidate_sites(fasta_seq, known["sites"], sampling.min_distance,
+                                                               sampling.keep_probability(organism), sampling.rng(protein_accession))
 
-        protein_name = df.loc[df.uniprotkb_canonical_ac == protein_accession, 'protein_name'].values[0]
-        tax_id = str(df.loc[df.uniprotkb_canonical_ac == protein_accession, 'taxonomy_id'].values[0])
+        protein_name = known["protein_name"]
+        tax_id = known["taxonomy_id"]
         
-        for s in s_res:
-            s_list = [
-                protein_accession,
-                protein_name,
-                gene_name,  # Placeholder for later population
-                str(s + 1),
-                "Ser",
-                "",
-                "",
-                "",
-                "",
-                "",
-                "",
-                fasta_seq[max(0, s - 5):s],
-                fasta_seq[s + 1:s + 6],
-                fasta_seq[max(0, s - 10):s],
-                fasta_seq[s + 1:s + 11], # Placeholder for later population
-                organism,
-                tax_id,
-                molecular_function,  # Placeholder for later population
-                biological_process,  # Placeholder for later population
-                cellular_component,
-                "",
-                "",
-                "unknown_glycosite"  # Placeholder for later population
-            ]
-        
-            s_row = "\t".join(s_list) + "\n"
-            with open("./output/supersearch_results.tsv", "a") as file:
-                file.write(s_row)
-
-        for t in t_res:
-            t_list = [
-                protein_accession,
-                protein_name,
-                gene_name,
-                str(t + 1),
-                "Thr",
-                "",
-                "",
-                "",
-                "",
-                "",
-                "",
-                fasta_seq[max(0, t - 5):t],
-                fasta_seq[t + 1:t + 6],
-                fasta_seq[max(0, t - 10):t],
-                fasta_seq[t + 1:t + 11],
-                organism,
-                tax_id,
-                molecular_function,
-                biological_process,
-                cellular_component,
-                "",
-                "",
-                "unknown_glycosite"
-            ]
-            t_row = "\t".join(t_list) + "\n"
-            with open("./output/supersearch_results.tsv", "a") as file:
-                file.write(t_row)
-
-        for y in y_res:
-            y_list = [
-                protein_accession,
-                protein_name,
-                gene_name,
-                str(y + 1),
-                "Tyr",
-                "",
-                "",
-                "",
-                "",
-                "",
-                "",
-                fasta_seq[max(0, y - 5):y],
-                fasta_seq[y + 1:y + 6],
-                fasta_seq[max(0, y - 10):y],
-                fasta_seq[y + 1:y + 11],
-                organism,
-                tax_id,
-                molecular_function,
-                biological_process,
-                cellular_component,
-                "",
-                "",
-                "unknown_glycosite"
-            ]
-            y_row = "\t".join(y_list) + "\n"
-            with open("./output/supersearch_results.tsv", "a") as file:
-                file.write(y_row)
-
-        for motif_pos, motif in motifs:
-            if motif[2] == 'S':
-                res_type = "Ser ARG"
-            else:
-                res_type = "Thr ARG"
-            motif_list = [
-                protein_accession,
-                protein_name,
-                gene_name,
-                str(motif_pos + 1),
-                res_type,
-                "",
-                "",
-                "",
-                "",
-                "",
-                "",
-                fasta_seq[max(0, motif_pos - 5):motif_pos],
-                fasta_seq[motif_pos + 1:motif_pos + 6],
-                fasta_seq[max(0, motif_pos - 10):motif_pos],
-                fasta_seq[motif_pos + 1:motif_pos + 11],
-                organism,
-                tax_id,
-                molecular_function,
-                biological_process,
-                cellular_component,
-                "",
-                "",
-                "unknown_glycosite"
-            ]
-            motif_row = "\t".join(motif_list) + "\n"
-            with open("./output/supersearch_results.tsv", "a") as file:
-                file.write(motif_row)
+        template = unknown_site_template(protein_accession, protein_name, gene_name, organism, tax_id,
+                                         molecular_function, biological_process, cellular_component)
+        # Domains of every candidate site of the protein, resolved in one call; an entry whose
+        # lookup failed has none saved and its sites get empty domain columns
+        domains = cache.get_domains(base_accession(protein_accession)) or build_domain_index([])
+        for residues, amino_acid in ((s_res, "Ser"), (t_res, "Thr"), (y_res, "Tyr")):
+            resolved = resolve_domains(domains, [pos + 1 for pos in residues])
+            for pos, (domain_range, domain) in zip(residues, resolved):
+                writer.writerow(unknown_site_row(template, fasta_seq, pos, amino_acid, domain_range, domain))
+
+        resolved = resolve_domains(domains, [motif_pos + 1 for motif_pos, _ in motifs])
+        for (motif_pos, motif), (domain_range, domain) in zip(motifs, resolved):
+            res_type = "Ser ARG" if motif[2] == 'S' else "Thr ARG"
+            writer.writerow(unknown_site_row(template, fasta_seq, motif_pos, res_type, domain_range, domain))
 
         count += 1
+    return missing
+
+def write_site_shard(known_items, shard_path, sampling=None):
+    # Runs in a worker process: every worker opens its own cache connection and shard file
+    cache = ProteinCache()
+    with BufferedRowWriter(shard_path, "w") as writer:
+        missing = write_unknown_sites(known_items, writer, cache, sampling=sampling)
+    cache.close()
+    return writer.rows_written, missing
+
+def shard_accessions(known_items, shard_count):
+    # Contiguous slices, so concatenating the shards in order keeps accession order
+    shard_size = -(-len(known_items) // shard_count) if known_items else 1
+    return [known_items[i:i + shard_size] for i in range(0, len(known_items), shard_size)]
+
+def plan_sampling(logger, known_sites, workers, sampling):
+    # Keep probabilities come from the whole proteome, also when only some proteins are regenerated
+    items = list(known_sites.items())
+    if workers <= 1:
+        cache = ProteinCache()
+        candidate_counts, known_counts = count_candidate_sites(items, cache, sampling)
+        cache.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shards = shard_accessions(items, workers * SHARDS_PER_WORKER)
+            candidate_counts, known_counts = merge_counts(executor.map(count_candidate_shard, shards, [sampling] * len(shards)))
+    sampling.plan(candidate_counts, known_counts)
+    logger.info(f"negative sampling: {sum(candidate_counts.values())} candidate sites, keep probabilities {sampling.probabilities}")
+
+def log_missing_proteins(logger, missing):
+    if missing:
+        logger.error(f"skipped the unknown sites of {missing} proteins missing from the protein cache")
+
+def sites_data(logger, known_sites, workers=1, accessions=None, sampling=None, journal=None):
+    # known_sites is the per-accession index built while the known sites were written.
+    # With a journal, progress is committed every SITE_CHECKPOINT_PROTEINS proteins
+    # (or every shard) and a resumed run starts after the last commit
+    if sampling is not None and sampling.ratios:
+        plan_sampling(logger, known_sites, workers, sampling)
+    if accessions is not None:
+        # Incremental runs only regenerate the given proteins
+        known_sites = {ac: known for ac, known in known_sites.items() if ac in accessions}
+    logger.info(f"generating the unknown sites of {len(known_sites)} proteins")
+    if journal is not None:
+        truncate_file(OUTPUT_PATH, journal.get("sites_offset"))
+
+    if workers <= 1:
+        # Protein entries are read lazily, one accession at a time
+        items = list(known_sites.items())
+        done = journal.get("sites_done", 0) if journal is not None else 0
+        chunk = SITE_CHECKPOINT_PROTEINS if journal is not None else max(len(items), 1)
+        missing = 0
+        cache = ProteinCache()
+        with BufferedRowWriter(OUTPUT_PATH, "a") as writer:
+            for start in range(done, len(items), chunk):
+                missing += write_unknown_sites(items[start:start + chunk], writer, cache, logger, sampling)
+                if journal is not None:
+                    writer.flush()
+                    journal.update(sites_done=min(start + chunk, len(items)), sites_offset=os.path.getsize(OUTPUT_PATH))
+        cache.close()
+        metrics.count_rows("unknown_sites", writer.rows_written)
+        log_missing_proteins(logger, missing)
+        return
+
+    # Shards hold every protein, so whatever an earlier attempt appended after the known rows goes
+    if journal is not None:
+        truncate_file(OUTPUT_PATH, journal.get("known_end", journal.get("sites_offset")))
+
+    # Several shards per worker so one slow slice does not hold up the pool
+    shards = shard_accessions(list(known_sites.items()), workers * SHARDS_PER_WORKER)
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    shard_paths = [os.path.join(SHARD_DIR, f"shard_{i:05d}.tsv") for i in range(len(shards))]
+
+    # Shards finished by an interrupted run with the same sharding are kept
+    done = set()
+    if journal is not None and journal.get("site_shard_count") == len(shards):
+        done = {i for i in journal.get("site_shards", []) if os.path.isfile(shard_paths[i])}
+
+    missing = 0
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(write_site_shard, shards[i], shard_paths[i], sampling): i
+                   for i in range(len(shards)) if i not in done}
+        for count, future in enumerate(as_completed(futures), start=1):
+            rows_written, shard_missing = future.result()
+            metrics.count_rows("unknown_sites", rows_written)
+            missing += shard_missing
+            done.add(futures[future])
+            if journal is not None:
+                journal.update(site_shards=sorted(done), site_shard_count=len(shards))
+            logger.info(f"Finished site shard {count}/{len(futures)} after {time.time() - start_time} seconds")
+
+    # Merge in shard order, which is accession order; the shards are only removed once
+    # the merge is complete, so an interrupted merge can start over
+    with open(OUTPUT_PATH, "ab") as outfile:
+        for shard_path in shard_paths:
+            with open(shard_path, "rb") as shard_file:
+                shutil.copyfileobj(shard_file, outfile, WRITE_BUFFER_SIZE)
+    for shard_path in shard_paths:
+        os.remove(shard_path)
+    try:
+        os.rmdir(SHARD_DIR)
+    except OSError:
+        pass  # holds something else
+    log_missing_proteins(logger, missing)
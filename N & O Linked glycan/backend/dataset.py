@@ -0,0 +1,81 @@
+import csv
+
+
+OUTPUT_PATH = "./output/supersearch_results.tsv"
+
+# Column order of the output dataset, shared by every stage that writes it
+COLUMNS = [ "uniprotkb_canonical_ac", "protein_name", "gene_name", "site", "amino_acid", "glycosylation_type",
+            "glycosylation_subtype", "glytoucan_ac", "reducing_end_monosaccharide",
+            "core_fucosylated", "source_tissue", "peptide_seq_five_before", "peptide_seq_five_after",
+            "peptide_seq_ten_before", "peptide_seq_ten_after", "organism", "taxonomy_id", "molecular_function",
+            "biological_process", "cellular_component", "domain", "range", "status"]
+COLUMN_INDEX = {column: i for i, column in enumerate(COLUMNS)}
+
+KNOWN_STATUS = "known_glycosite"
+UNKNOWN_STATUS = "unknown_glycosite"
+
+WRITE_BUFFER_SIZE = 1 << 20
+WRITE_BATCH_ROWS = 10000
+
+
+def unknown_site_template(protein_accession, protein_name, gene_name, organism, tax_id,
+                          molecular_function, biological_process, cellular_component):
+    # Protein-level fields of an unknown-site row; the site-level fields are filled by unknown_site_row
+    row = [""] * len(COLUMNS)
+    row[COLUMN_INDEX["uniprotkb_canonical_ac"]] = protein_accession
+    row[COLUMN_INDEX["protein_name"]] = protein_name
+    row[COLUMN_INDEX["gene_name"]] = gene_name
+    row[COLUMN_INDEX["organism"]] = organism
+    row[COLUMN_INDEX["taxonomy_id"]] = tax_id
+    row[COLUMN_INDEX["molecular_function"]] = molecular_function
+    row[COLUMN_INDEX["biological_process"]] = biological_process
+    row[COLUMN_INDEX["cellular_component"]] = cellular_component
+    row[COLUMN_INDEX["status"]] = UNKNOWN_STATUS
+    return row
+
+
+def unknown_site_row(template, fasta_seq, pos, amino_acid, domain_range="", domain=""):
+    # pos is the 0-based residue index, the site column is 1-based
+    row = list(template)
+    row[COLUMN_INDEX["domain"]] = domain
+    row[COLUMN_INDEX["range"]] = domain_range
+    row[COLUMN_INDEX["site"]] = str(pos + 1)
+    row[COLUMN_INDEX["amino_acid"]] = amino_acid
+    row[COLUMN_INDEX["peptide_seq_five_before"]] = fasta_seq[max(0, pos - 5):pos]
+    row[COLUMN_INDEX["peptide_seq_five_after"]] = fasta_seq[pos + 1:pos + 6]
+    row[COLUMN_INDEX["peptide_seq_ten_before"]] = fasta_seq[max(0, pos - 10):pos]
+    row[COLUMN_INDEX["peptide_seq_ten_after"]] = fasta_seq[pos + 1:pos + 11]
+    return row
+
+
+class BufferedRowWriter:
+    """Keeps one handle open on a TSV and writes rows in large batches."""
+
+    def __init__(self, path, mode="a", batch_rows=WRITE_BATCH_ROWS):
+        self._file = open(path, mode, newline='', buffering=WRITE_BUFFER_SIZE)
+        self._writer = csv.writer(self._file, delimiter='\t')
+        self._batch = []
+        self._batch_rows = batch_rows
+        self.rows_written = 0
+
+    def writerow(self, row):
+        self._batch.append(row)
+        if len(self._batch) >= self._batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self._batch:
+            self._writer.writerows(self._batch)
+            self.rows_written += len(self._batch)
+            self._batch.clear()
+        self._file.flush()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
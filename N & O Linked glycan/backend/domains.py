@@ -0,0 +1,60 @@
+from bisect import bisect_right
+
+
+# Separator used when a site falls inside more than one domain
+DOMAIN_SEPARATOR = "; "
+
+
+def base_accession(accession):
+    # UniProt entry of an isoform accession, P12345-2 -> P12345; the EBI keys domains by entry
+    return accession.split("-")[0]
+
+
+def parse_position(value):
+    # UniProt marks uncertain feature ends as "<12" / ">250"
+    return int(str(value).lstrip("<>~"))
+
+
+def build_domain_index(intervals):
+    # intervals: (start, end, description) tuples. The index keeps them as parallel
+    # lists sorted by start, plus the running maximum of the ends, so the domains
+    # covering a site are found by bisecting the starts and walking back only while
+    # an earlier domain can still reach the site.
+    intervals = sorted(intervals, key=lambda interval: (interval[0], interval[1]))
+    max_ends = []
+    max_end = 0
+    for _, end, _ in intervals:
+        max_end = max(max_end, end)
+        max_ends.append(max_end)
+    return {
+        "starts": [start for start, _, _ in intervals],
+        "ends": [end for _, end, _ in intervals],
+        "max_ends": max_ends,
+        "descriptions": [desc for _, _, desc in intervals],
+    }
+
+
+def overlapping_domains(domains, site):
+    # Indexes of every domain with start <= site <= end, in start order
+    starts, ends, max_ends = domains["starts"], domains["ends"], domains["max_ends"]
+    hits = []
+    i = bisect_right(starts, site) - 1
+    while i >= 0 and max_ends[i] >= site:
+        if ends[i] >= site:
+            hits.append(i)
+        i -= 1
+    hits.reverse()
+    return hits
+
+
+def resolve_domains(domains, sites):
+    # (range, domain) column values for each of a protein's sites, in one call
+    starts, ends, descriptions = domains["starts"], domains["ends"], domains["descriptions"]
+    resolved = []
+    for site in sites:
+        hits = overlapping_domains(domains, site)
+        resolved.append((
+            DOMAIN_SEPARATOR.join(f"{starts[i]}-{ends[i]}" for i in hits),
+            DOMAIN_SEPARATOR.join(descriptions[i] or "" for i in hits),
+        ))
+    return resolved
@@ -0,0 +1,116 @@
+import os
+import json
+import time
+from functools import lru_cache
+from .dataset import OUTPUT_PATH, KNOWN_STATUS, UNKNOWN_STATUS
+from .protein_cache import ProteinCache
+
+
+FEATURE_DIR = "./output/features"
+FEATURE_WINDOW = 10
+
+# Residue codes: 0 pads windows that run past either end of the sequence, the 20 standard
+# amino acids follow in alphabetical order and every other letter (X, U, B, Z, ...) is the last code
+PAD_CODE = 0
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+OTHER_CODE = len(AMINO_ACIDS) + 1
+ALPHABET_SIZE = len(AMINO_ACIDS) + 2
+
+
+@lru_cache(maxsize=None)
+def residue_lut():
+    # Byte -> residue code; numpy is only imported once features are exported
+    import numpy as np
+    lut = np.full(256, OTHER_CODE, dtype=np.uint8)
+    for code, letter in enumerate(AMINO_ACIDS, start=1):
+        lut[ord(letter)] = code
+        lut[ord(letter.lower())] = code
+    return lut
+
+
+def encode_sequence(fasta_seq):
+    import numpy as np
+    return residue_lut()[np.frombuffer(fasta_seq.encode("ascii", "replace"), dtype=np.uint8)]
+
+
+def sequence_windows(fasta_seq, sites, window=FEATURE_WINDOW):
+    # Integer-encoded +/-window residues around each 1-based site, shape (len(sites), 2*window+1).
+    # The sequence is encoded and padded once; every window is a row of a strided view of it
+    import numpy as np
+    from numpy.lib.stride_tricks import sliding_window_view
+    width = 2 * window + 1
+    windows = np.zeros((len(sites), width), dtype=np.uint8)
+    encoded = encode_sequence(fasta_seq)
+    valid = (sites >= 1) & (sites <= len(encoded))
+    if valid.any():
+        padded = np.concatenate([np.zeros(window, dtype=np.uint8), encoded, np.zeros(window, dtype=np.uint8)])
+        windows[valid] = sliding_window_view(padded, width)[sites[valid] - 1]
+    return windows
+
+
+def read_site_table(source):
+    import numpy as np
+    import pandas as pd
+    frame = pd.read_csv(source, sep="\t", dtype=str, keep_default_na=False,
+                        usecols=["uniprotkb_canonical_ac", "site", "amino_acid", "status"])
+    sites = pd.to_numeric(frame["site"], errors="coerce").fillna(0).astype(np.int64).to_numpy()
+    return frame, sites
+
+
+def export_features(logger, window=FEATURE_WINDOW, one_hot=False, source=OUTPUT_PATH, feature_dir=FEATURE_DIR):
+    # Row i of every array is data row i of the TSV
+    import numpy as np
+    import pandas as pd
+    start_time = time.time()
+    frame, sites = read_site_table(source)
+    row_count = len(frame)
+    width = 2 * window + 1
+    os.makedirs(feature_dir, exist_ok=True)
+
+    labels = (frame["status"] == KNOWN_STATUS).to_numpy().astype(np.int8)
+    residue_codes, residue_types = pd.factorize(frame["amino_acid"])
+    np.save(os.path.join(feature_dir, "labels.npy"), labels)
+    np.save(os.path.join(feature_dir, "residue_type.npy"), residue_codes.astype(np.int16))
+
+    windows = np.lib.format.open_memmap(os.path.join(feature_dir, "windows.npy"), mode="w+",
+                                        dtype=np.uint8, shape=(row_count, width))
+    onehot = None
+    if one_hot:
+        onehot = np.lib.format.open_memmap(os.path.join(feature_dir, "windows_onehot.npy"), mode="w+",
+                                           dtype=np.uint8, shape=(row_count, width, ALPHABET_SIZE))
+    identity = np.eye(ALPHABET_SIZE, dtype=np.uint8)
+
+    # Rows of a protein are spread over the file (known sites first, unknown ones later);
+    # each protein's sequence is read once and all of its windows written in one go
+    missing = 0
+    cache = ProteinCache()
+    for protein_accession, rows in frame.groupby("uniprotkb_canonical_ac", sort=False).indices.items():
+        target_data = cache.get(protein_accession)
+        if target_data is None:
+            # Left as padding: the protein was never fetched
+            missing += 1
+            continue
+        protein_windows = sequence_windows(target_data["fasta_seq"], sites[rows], window)
+        windows[rows] = protein_windows
+        if onehot is not None:
+            onehot[rows] = identity[protein_windows]
+    cache.close()
+
+    windows.flush()
+    if onehot is not None:
+        onehot.flush()
+
+    meta = {
+        "source": source,
+        "rows": row_count,
+        "window": window,
+        "alphabet": ["<pad>"] + list(AMINO_ACIDS) + ["<other>"],
+        "residue_types": [str(residue) for residue in residue_types],
+        "labels": {"1": KNOWN_STATUS, "0": UNKNOWN_STATUS},
+        "one_hot": one_hot,
+    }
+    with open(os.path.join(feature_dir, "features.json"), "w") as meta_file:
+        json.dump(meta, meta_file, indent=2)
+
+    logger.info(f"wrote {row_count} feature windows to {feature_dir} in {time.time() - start_time} seconds "
+                f"({missing} proteins without a cached sequence)")
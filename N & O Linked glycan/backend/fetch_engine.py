@@ -0,0 +1,92 @@
+import time
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from .http_client import set_pool_size
+from .rate_control import configure_rate_control, host_controller, HOST_CONCURRENCY, HOST_RATE_LIMIT
+from .metrics import metrics
+
+
+# Hosts the engine is expected to talk to at the same time (GlyGen API, GlyGen data, EBI)
+ENGINE_HOSTS = 3
+
+
+def url_host(url):
+    return urlparse(url).netloc
+
+
+class HostGate:
+    """Admits calls to one host while fewer than its controller's limit are in flight.
+
+    Works like an ``asyncio.Semaphore`` whose size the host's controller changes
+    as requests complete; a limit that shrinks takes effect as calls finish.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.in_flight = 0
+        self._waiters = deque()
+
+    async def __aenter__(self):
+        while self.in_flight >= self.controller.concurrency:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self._wake()
+                raise
+        self.in_flight += 1
+
+    async def __aexit__(self, *exc_info):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        # The limit may have grown since the last call finished, so wake every waiter that fits
+        for _ in range(self.controller.concurrency - self.in_flight):
+            while self._waiters and self._waiters[0].done():
+                self._waiters.popleft()
+            if not self._waiters:
+                return
+            self._waiters.popleft().set_result(None)
+
+
+class FetchEngine:
+    """Runs the blocking fetch helpers from asyncio, bounded per upstream host.
+
+    Requests still go through the pooled client in ``http_client`` (so retries
+    and connection reuse are shared); the event loop only decides how many are
+    in flight against each host at once, following the host's controller in
+    ``rate_control`` up to ``host_concurrency``.
+    """
+
+    def __init__(self, host_concurrency=HOST_CONCURRENCY, rate_limit=HOST_RATE_LIMIT):
+        self.host_concurrency = host_concurrency
+        self._gates = {}
+        self._executor = ThreadPoolExecutor(max_workers=host_concurrency * ENGINE_HOSTS)
+        set_pool_size(host_concurrency)
+        configure_rate_control(host_concurrency, rate_limit)
+
+    def _gate(self, host):
+        gate = self._gates.get(host)
+        if gate is None:
+            gate = self._gates[host] = HostGate(host_controller(host))
+        return gate
+
+    async def run(self, host, func, *args):
+        gate = self._gate(host)
+        queued_at = time.perf_counter()
+        async with gate:
+            metrics.record_wait(host, time.perf_counter() - queued_at)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, metrics.profiled(func), *args)
+
+    async def run_local(self, func, *args):
+        # Blocking work that is not a request to a tracked host (cache reads, GO index loads)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, metrics.profiled(func), *args)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
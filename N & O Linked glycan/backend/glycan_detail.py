@@ -1,95 +1,106 @@
-import requests
-import pandas as pd
-import re
-from functools import reduce
-import time
-import random 
-import os
+import asyncio
 from io import StringIO
-import logging
-import json
-from csv import DictReader, DictWriter
+from .http_client import post_json, get_text
+from .fetch_engine import url_host
+from .metrics import metrics
 
 
 # Define URLs and payloads
-SEARCH_URL = "https://beta-api.glygen.org/supersearch/search"
-LIST_URL = "https://beta-api.glygen.org/supersearch/list/"
 GLYCAN_URL = "https://beta-api.glygen.org/glycan/detail/"
-OUTPUT_PATH = "./output/supersearch_results.tsv" 
 REDENDMONO_URL = "https://github.com/glygen-glycan-data/PyGly/raw/master/smw/glycandata/export/redendmono.tsv"
+GLYCAN_HOST = url_host(GLYCAN_URL)
+GLYCAN_BATCH_ROWS = 1000
+GLYCAN_COLUMNS = ['core_fucosylated', 'source_tissue', 'reducing_end_monosaccharide']
+REDENDMONO_HOST = url_host(REDENDMONO_URL)
 
 
 def fetch_glycan_with_backoff(ac, max_retries=5):
-    retry_delay = 1
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url=f"{GLYCAN_URL}{ac}", json={"glytoucan_ac": ac}) # to get GO:
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException:
-            time.sleep(retry_delay)
-            retry_delay *= 2
-            retry_delay += random.uniform(0, 1)
-            raise Exception("Maximum retry attempts reached")
+    return post_json(f"{GLYCAN_URL}{ac}", {"glytoucan_ac": ac}, max_retries)
 
-def get_glycan_data(logger):
-    # Load the existing data
-    df = pd.read_csv(REDENDMONO_URL, sep='\t')
-    df1 = pd.read_csv(OUTPUT_PATH, delimiter='\t') if os.path.exists(OUTPUT_PATH) else pd.DataFrame()
-    #df1 = pd.read_csv(OUTPUT_PATH, delimiter='\t')
-    merged_df = pd.concat([df1, df], axis=1)
-    #merged_df = df1.merge(df, left_on='glytoucan_ac', right_on='accession', how='left')
-    df1['reducing_end_monosaccharide'] = merged_df['monosaccharide']
-    # Get unique uniprotkb_canonical_ac values
-    unique_ac = df1['glytoucan_ac'].unique()
-    unique_ac_list = unique_ac.tolist()
-    print(unique_ac_list)
-    unique_ac_list = [x for x in unique_ac_list if str(x).lower() != "nan"]
+def load_reducing_end_monosaccharides():
+    # Reducing end table indexed by glytoucan_ac
+    import pandas as pd
+    df = pd.read_csv(StringIO(get_text(REDENDMONO_URL)), sep='\t')
+    df = df.rename(columns={'accession': 'glytoucan_ac', 'monosaccharide': 'reducing_end_monosaccharide'})
+    return df.drop_duplicates('glytoucan_ac').set_index('glytoucan_ac')[['reducing_end_monosaccharide']]
 
-    print(unique_ac)
-    print(len(unique_ac_list))
+def glycan_annotations(glycan_data):
+    # Core fucosylation and source tissue info; None when the glycan has no expression data
+    core_fucosylated = ""
+    for classification in glycan_data.get("classification", []):
+        subtype_name = classification.get("subtype", {}).get("name")
+        if subtype_name == "Core-fucosylated":
+            core_fucosylated = "Y"
+        else:
+            core_fucosylated = "N"
 
-    columns = [ "uniprotkb_canonical_ac", "protein_name","gene_name",	"site",	"amino_acid","glycosylation_type", 
-                "glycosylation_subtype", "glytoucan_ac", "reducing_end_monosaccharide",
-                "core_fucosylated","source_tissue", "peptide_seq_five_before", "peptide_seq_five_after", 
-                "peptide_seq_ten_before", "peptide_seq_ten_after","organism", "taxonomy_id","molecular_function",
-                "biological_process","cellular_component", "domain", "range", "status"]
-    
+    if not glycan_data.get("expression"):
+        return None
 
- 
-# Core fucosylation and source tissue info
-    subtypes = []
-    core_fucosylated = None
-    for ac in unique_ac_list:
-        print(ac)
-        glycan_data = fetch_glycan_with_backoff(ac, max_retries=5) # Get glycan details
-        
-        for classification in glycan_data.get("classification", []):
-            subtype_name = classification.get("subtype", {}).get("name")
-            if subtype_name:
-                subtypes.append(subtype_name)
-            if subtype_name == "Core-fucosylated":
-                core_fucosylated = "Y"
-            else:
-                core_fucosylated = "N"
+    source_tissue = []
+    for expression_info in glycan_data["expression"]:
+        if expression_info.get("category") == "tissue":
+            tissue = expression_info.get("tissue", {})
+            name = tissue.get("name", "")
+            namespace = tissue.get("namespace", "")
+            id = tissue.get("id", "")
+            source_tissue.append(f"{name} ({namespace} : {id})")
+    return core_fucosylated, ";".join(source_tissue)
 
-        
-        if glycan_data.get("expression"):
-            source_tissue_info = ""
-            source_tissue = []
-            for expression_info in glycan_data["expression"]:
-                if expression_info.get("category") == "tissue":
-                    tissue = expression_info.get("tissue", {})
-                    name = tissue.get("name", "")
-                    namespace = tissue.get("namespace", "")
-                    id = tissue.get("id", "")                     
-                    source_tissue.append(f"{name} ({namespace} : {id})")
-            source_tissue_info = ";".join(source_tissue)
-                        # Add the core_fucosylated and source_tissue fields to the DataFrame df1
-        
-            df1.loc[df1.glytoucan_ac == ac, ['core_fucosylated']] = core_fucosylated
-            df1.loc[(df1.glytoucan_ac == ac) & (df1.uniprotkb_canonical_ac), ['source_tissue']] = source_tissue_info  #both "glytoucan_ac" and "uniprot_canonical_ac" columns match the source_tissue_info values
-       
-        
-        # Save the final DataFrame to a file
-    df1.to_csv(OUTPUT_PATH, sep='\t', index=False)
+def glycan_table_from(annotations):
+    # Per-glycan table of the annotations; glycans without expression data get no row
+    import pandas as pd
+    records = [(ac, *values) for ac, values in annotations.items() if values is not None]
+    return pd.DataFrame(records, columns=['glytoucan_ac', 'core_fucosylated', 'source_tissue']).set_index('glytoucan_ac')
+
+async def fetch_glycan_annotations(engine, glycan_acs):
+    # Glycan details fetched concurrently: glytoucan_ac -> annotations (None without expression data)
+    glycan_list = await asyncio.gather(*(engine.run(GLYCAN_HOST, fetch_glycan_with_backoff, ac, 5) for ac in glycan_acs))
+    return {ac: glycan_annotations(glycan_data) for ac, glycan_data in zip(glycan_acs, glycan_list)}
+
+def join_glycan_columns(batch, glycan_table, reducing_end):
+    # One hash join of the batch's glytoucan_ac against both tables
+    import pandas as pd
+    keys = pd.DataFrame({'glytoucan_ac': [row.get("glytoucan_ac") or None for row in batch]}, dtype=object)
+    joined = keys.join(glycan_table, on='glytoucan_ac').join(reducing_end, on='glytoucan_ac')
+    joined = joined[GLYCAN_COLUMNS].astype(object).where(joined[GLYCAN_COLUMNS].notna(), "")
+    for row, values in zip(batch, joined.itertuples(index=False, name=None)):
+        row.update(zip(GLYCAN_COLUMNS, values))
+    return batch
+
+async def enrich_glycans(rows, engine, logger, batch_rows=GLYCAN_BATCH_ROWS, journal=None):
+    # Glycan stage of the pipeline: rows are annotated in batches as they
+    # stream past; glycans not seen before are fetched together for each batch
+    # (and recorded in the journal, which a resumed run starts from)
+    import pandas as pd
+    reducing_end = await engine.run(REDENDMONO_HOST, load_reducing_end_monosaccharides)
+    journaled = journal.glycans() if journal is not None else {}
+    glycan_table = glycan_table_from(journaled)
+    fetched = set(journaled)
+
+    async def annotate(batch):
+        nonlocal glycan_table
+        batch_acs = {row.get("glytoucan_ac") for row in batch if row.get("glytoucan_ac")}
+        new_acs = list(dict.fromkeys(row.get("glytoucan_ac") for row in batch if row.get("glytoucan_ac") and row.get("glytoucan_ac") not in fetched))
+        metrics.count_cache("glycan", "hits", len(batch_acs) - len(new_acs))
+        metrics.count_cache("glycan", "misses", len(new_acs))
+        if new_acs:
+            fetched.update(new_acs)
+            annotations = await fetch_glycan_annotations(engine, new_acs)
+            if journal is not None:
+                journal.put_glycans(annotations)
+            glycan_table = pd.concat([glycan_table, glycan_table_from(annotations)])
+        return join_glycan_columns(batch, glycan_table, reducing_end)
+
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            for row in await annotate(batch):
+                yield row
+            batch = []
+    if batch:
+        for row in await annotate(batch):
+            yield row
+
+    logger.info(f"Annotated {len(fetched)} glycans")
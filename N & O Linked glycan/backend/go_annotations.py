@@ -0,0 +1,129 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from io import BytesIO
+from .http_client import fetch_if_modified
+
+
+GO_INDEX_DIR = "./output/go_index"
+GO_CATEGORIES = ["molecular_function", "biological_process", "cellular_component"]
+
+GO_CSV_URLS = {
+    'Homo sapiens': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/human_protein_go_annotation.csv',
+    'Mus musculus': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/mouse_protein_go_annotation.csv',
+    'Gallus gallus': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/chicken_protein_go_annotation.csv',
+    'Dictyostelium discoideum': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/dicty_protein_go_annotation.csv',
+    'Drosophila melanogaster': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/fruitfly_protein_go_annotation.csv',
+    'Hepacivirus C genotype 1a': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/hcv1a_protein_go_annotation.csv',
+    'Hepacivirus C genotype 1b': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/hcv1b_protein_go_annotation.csv',
+    'Sus scrofa': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/pig_protein_go_annotation.csv',
+    'Rattus norvegicus': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/rat_protein_go_annotation.csv',
+    'Severe acute respiratory syndrome coronavirus 1': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/sarscov1_protein_go_annotation.csv',
+    'Severe acute respiratory syndrome coronavirus 2': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/sarscov2_protein_go_annotation.csv',
+    'Saccharomyces cerevisiae S288C': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/yeast_protein_go_annotation.csv'
+}
+
+# organism -> {uniprotkb_canonical_ac: [molecular_function, biological_process, cellular_component]}
+_go_indexes = {}
+_go_lock = threading.Lock()
+
+
+def build_go_index(linked_df):
+    # Collapse the annotation table into one entry per accession with the three
+    # category strings already joined, keeping the row order of the CSV
+    linked_df = linked_df[linked_df['go_term_category'].isin(GO_CATEGORIES)]
+    terms = (linked_df['go_term_label'].map(str) + " ("
+             + linked_df['go_term_id'].map(str).str.replace('_', ':') + ")")
+    joined = terms.groupby([linked_df['uniprotkb_canonical_ac'], linked_df['go_term_category']], sort=False).agg('; '.join)
+
+    go_index = {}
+    for (protein_accession, category), value in joined.items():
+        entry = go_index.setdefault(protein_accession, ['', '', ''])
+        entry[GO_CATEGORIES.index(category)] = value
+    return go_index
+
+
+def go_index_path(link, index_dir=GO_INDEX_DIR):
+    name = os.path.basename(link).rsplit('.', 1)[0]
+    return os.path.join(index_dir, name + ".json")
+
+
+def read_json(path):
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    with open(path + ".tmp", "w") as json_file:
+        json.dump(data, json_file)
+    os.replace(path + ".tmp", path)
+
+
+def clear_go_indexes(index_dir=GO_INDEX_DIR):
+    # --nocache: every GO index is rebuilt from a fresh download
+    shutil.rmtree(index_dir, ignore_errors=True)
+    _go_indexes.clear()
+
+
+def load_go_index(organism, index_dir=GO_INDEX_DIR):
+    link = GO_CSV_URLS.get(organism)
+    if not link:
+        return None
+
+    # Fast path: already loaded by this process
+    go_index = _go_indexes.get(organism)
+    if go_index is not None:
+        return go_index
+
+    logger = logging.getLogger(__name__)
+    with _go_lock:
+        go_index = _go_indexes.get(organism)
+        if go_index is not None:
+            return go_index
+
+        # The index is kept with the version (time and validators) of the CSV it was built from,
+        # and follows the response cache's TTL: once that has passed the CSV is revalidated,
+        # and the index rebuilt only if the server has a new one
+        index_path = go_index_path(link, index_dir)
+        version_path = index_path.rsplit('.', 1)[0] + ".version.json"
+        version = read_json(version_path)
+        go_index = read_json(index_path) if version is not None else None
+        if go_index is None:
+            version = None
+        try:
+            content, new_version = fetch_if_modified(link, version)
+            if content is not None:
+                import pandas as pd
+                go_index = build_go_index(pd.read_csv(BytesIO(content)))
+        except Exception as e:
+            if go_index is not None:
+                logger.error(f"Could not revalidate the GO annotations of {organism}, using the index built earlier. Error: {e}")
+                _go_indexes[organism] = go_index
+                return go_index
+            # Remember the failure for this run only so every protein does not retry the download
+            logger.error(f"Error reading CSV file for organism: {organism} from link: {link}. Error: {e}")
+            _go_indexes[organism] = {}
+            return _go_indexes[organism]
+
+        os.makedirs(index_dir, exist_ok=True)
+        if content is not None:
+            write_json(index_path, go_index)
+        if new_version is not version:
+            write_json(version_path, new_version)
+
+        _go_indexes[organism] = go_index
+        return go_index
+
+
+def lookup_go_annotations(protein_accession, organism):
+    go_index = load_go_index(organism)
+    if go_index is None:
+        logging.getLogger(__name__).error(f"No CSV file link found for organism: {organism}")
+        return '', '', ''
+    molecular_function, biological_process, cellular_component = go_index.get(protein_accession, ('', '', ''))
+    return molecular_function, biological_process, cellular_component
@@ -0,0 +1,183 @@
+import time
+import random
+import json
+import threading
+from urllib.parse import urlparse
+from .response_cache import ResponseCache, HTTP_CACHE_DIR, HTTP_CACHE_TTL
+from .metrics import metrics
+from .rate_control import host_controller, retry_after_seconds, THROTTLE_STATUSES
+
+
+# Connections kept per host; at least as large as the biggest thread pool using the client
+POOL_SIZE = 32
+# Number of distinct hosts whose pools are kept open (GlyGen api/beta-api/data, EBI, GitHub)
+POOL_HOSTS = 8
+REQUEST_TIMEOUT = 60
+MAX_RETRIES = 5
+
+_session = None
+_session_lock = threading.Lock()
+_response_cache = ResponseCache()
+# Upstream origin -> origin actually requested, e.g. a local stand-in server for benchmarks
+_url_overrides = {}
+
+
+def get_session():
+    # One keep-alive session for the whole process, shared by every backend module
+    global _session
+    if _session is None:
+        # requests is only imported once something is actually fetched
+        import requests
+        from requests.adapters import HTTPAdapter
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Accept-Encoding": "gzip, deflate"})
+                _session = session
+    return _session
+
+
+def set_pool_size(pool_size):
+    # Resize the per-host pools to match the caller's concurrency; takes effect on the next request
+    global POOL_SIZE, _session
+    with _session_lock:
+        if pool_size <= POOL_SIZE:
+            return
+        POOL_SIZE = pool_size
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def configure_url_overrides(overrides):
+    # overrides: {"https://api.glygen.org": "http://127.0.0.1:8765/api.glygen.org", ...}
+    global _url_overrides
+    _url_overrides = {origin.rstrip("/"): replacement.rstrip("/") for origin, replacement in overrides.items()}
+
+
+def parse_url_override(text):
+    # "ORIGIN=REPLACEMENT" as given on the command line
+    origin, _, replacement = text.partition("=")
+    if not origin or not replacement:
+        raise ValueError(f"expected ORIGIN=REPLACEMENT, got {text!r}")
+    return origin, replacement
+
+
+def resolve_url(url):
+    for origin, replacement in _url_overrides.items():
+        if url.startswith(origin + "/") or url == origin:
+            return replacement + url[len(origin):]
+    return url
+
+
+def request_with_backoff(method, url, max_retries=MAX_RETRIES, **kwargs):
+    # Retries throttled (429/503), failed (5xx) and unreachable requests with exponential
+    # backoff and jitter, never sooner than the server's Retry-After; any other 4xx is
+    # raised at once. Every attempt goes through the host's controller, and metrics stay
+    # keyed by the upstream host when the URL is overridden
+    import requests
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    host = urlparse(url).netloc
+    controller = host_controller(host)
+    url = resolve_url(url)
+    retry_delay = 1
+    for attempt in range(max_retries):
+        metrics.record_rate_wait(host, controller.acquire())
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, url, **kwargs)
+        except requests.RequestException:
+            response = None
+        seconds = time.perf_counter() - start
+        if response is not None and response.status_code < 400:
+            controller.record_success(seconds)
+            metrics.record_request(host, seconds, len(response.content))
+            return response
+
+        metrics.record_request(host, seconds, ok=False)
+        if response is not None and response.status_code in THROTTLE_STATUSES:
+            metrics.record_throttle(host)
+            controller.record_throttle(response.status_code, retry_after_seconds(response.headers.get("Retry-After")))
+        elif response is not None and response.status_code < 500:
+            response.raise_for_status()
+        else:
+            controller.record_failure()
+        if attempt == max_retries - 1:
+            break
+        metrics.record_retry(host)
+        # A Retry-After longer than this is waited out in controller.acquire()
+        time.sleep(retry_delay)
+        retry_delay *= 2
+        retry_delay += random.uniform(0, 1)
+    raise Exception("Maximum retry attempts reached")
+
+
+def configure_response_cache(directory=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, revalidate=False, enabled=True):
+    global _response_cache
+    _response_cache = ResponseCache(directory, ttl, revalidate) if enabled else None
+
+
+def evict_response(method, url, payload=None):
+    # Drops the cached response of a request, so the next one goes to the server
+    if _response_cache is not None:
+        _response_cache.evict(_response_cache.key(method, resolve_url(url), payload))
+
+
+def fetch_content(method, url, max_retries=MAX_RETRIES, cache=True, headers=None, **kwargs):
+    # Response body for the request, served from the response cache when it is fresh
+    # or the server confirms (304) that it has not changed
+    response_cache = _response_cache if cache else None
+    if response_cache is None:
+        return request_with_backoff(method, url, max_retries, headers=headers, **kwargs).content
+
+    # Keyed by the URL actually requested, so responses of an overridden origin never mix with real ones
+    key = response_cache.key(method, resolve_url(url), kwargs.get("json"))
+    meta, body = response_cache.load(key)
+    if meta is not None and response_cache.is_fresh(meta):
+        metrics.count_cache("http_response", "hits")
+        return body
+
+    headers = dict(headers or {})
+    if meta is not None:
+        headers.update(response_cache.validators(meta))
+    response = request_with_backoff(method, url, max_retries, headers=headers, **kwargs)
+    if response.status_code == 304 and meta is not None:
+        metrics.count_cache("http_response", "revalidated")
+        response_cache.touch(key, meta)
+        return body
+    metrics.count_cache("http_response", "misses")
+    response_cache.store(key, url, response)
+    return response.content
+
+
+def fetch_if_modified(url, version=None, max_retries=MAX_RETRIES):
+    # For data derived from a download (such as the GO indexes): version holds the stored_at
+    # time and validators of the download it was built from. Returns (None, version) while that
+    # is still current, and (body, new version) once the server has a new one. The body itself
+    # is not kept in the response cache, only whatever the caller derives from it
+    if version is not None and _response_cache is not None and _response_cache.is_fresh(version):
+        return None, version
+    headers = ResponseCache.validators(version) if version is not None else {}
+    response = request_with_backoff("GET", url, max_retries, headers=headers)
+    if response.status_code == 304 and version is not None:
+        return None, dict(version, stored_at=time.time())
+    return response.content, {
+        "stored_at": time.time(),
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+
+
+def post_json(url, payload, max_retries=MAX_RETRIES, cache=True):
+    return json.loads(fetch_content("POST", url, max_retries, cache, json=payload))
+
+
+def get_json(url, max_retries=MAX_RETRIES, cache=True):
+    return json.loads(fetch_content("GET", url, max_retries, cache, headers={"Accept": "application/json"}))
+
+
+def get_text(url, max_retries=MAX_RETRIES, cache=True):
+    return fetch_content("GET", url, max_retries, cache).decode("utf-8")
@@ -0,0 +1,129 @@
+import os
+import csv
+import hashlib
+from .dataset import OUTPUT_PATH, KNOWN_STATUS, UNKNOWN_STATUS, BufferedRowWriter
+from .amino_acid_sites import sites_data
+from .protein_cache import ProteinCache
+from .domains import base_accession
+from .protein_details import forget_protein_details
+
+
+PREVIOUS_PATH = "./output/previous_results.tsv"
+
+# A known site is identified by (accession, site, type); these list fields decide whether it changed
+DIFF_FIELDS = ["protein_name", "amino_acid", "glycosylation_subtype", "peptide_seq_five_before",
+               "peptide_seq_five_after", "peptide_seq_ten_before", "peptide_seq_ten_after", "taxonomy_id"]
+
+
+class IncrementalPlan:
+    """What an --incremental run has to redo, relative to the previous output."""
+
+    def __init__(self, previous_path):
+        self.previous_path = previous_path
+        # Accessions with a new, changed or removed known site: re-enriched
+        self.changed_accessions = set()
+        # Accessions whose set of known sites changed: unknown sites regenerated
+        self.site_changed_accessions = set()
+        # Sequence fingerprints of the changed accessions before they were re-fetched
+        self.previous_sequences = {}
+
+
+def index_known_sites(rows):
+    known_sites = {}
+    for row in rows:
+        if row.get("status") != KNOWN_STATUS:
+            continue
+        key = (row["uniprotkb_canonical_ac"], str(row["site"]), row["glycosylation_type"])
+        known_sites[key] = tuple(str(row.get(field) or "") for field in DIFF_FIELDS)
+    return known_sites
+
+
+def read_known_sites(path):
+    with open(path, "r", newline='') as infile:
+        return index_known_sites(csv.DictReader(infile, delimiter='\t'))
+
+
+def sites_by_accession(known_sites):
+    sites = {}
+    for protein_accession, site, _ in known_sites:
+        sites.setdefault(protein_accession, set()).add(site)
+    return sites
+
+
+def sequence_fingerprint(target_data):
+    if target_data is None:
+        return None
+    return hashlib.sha256(target_data["fasta_seq"].encode("utf-8")).hexdigest()
+
+
+def start_incremental(logger, output_path=OUTPUT_PATH, previous_path=PREVIOUS_PATH):
+    # Move the last output aside so the list stage pulls a fresh site list
+    if os.path.isfile(previous_path):
+        # An earlier incremental run stopped before finishing; its baseline is still the right one
+        logger.info("resuming from the previous output left by an interrupted incremental run")
+        return IncrementalPlan(previous_path)
+    if not os.path.isfile(output_path):
+        logger.info("no previous output found, running a full refresh")
+        return None
+    os.replace(output_path, previous_path)
+    return IncrementalPlan(previous_path)
+
+
+def plan_incremental(plan, logger, records):
+    # records: the freshly listed known sites, before enrichment
+    previous = read_known_sites(plan.previous_path)
+    current = index_known_sites(records)
+
+    for key in previous.keys() | current.keys():
+        if previous.get(key) != current.get(key):
+            plan.changed_accessions.add(key[0])
+
+    previous_sites = sites_by_accession(previous)
+    current_sites = sites_by_accession(current)
+    for protein_accession in previous_sites.keys() | current_sites.keys():
+        if previous_sites.get(protein_accession) != current_sites.get(protein_accession):
+            plan.site_changed_accessions.add(protein_accession)
+
+    # Drop the cached protein (and domain) data of changed accessions so enrichment re-fetches them,
+    # keeping a fingerprint of the old sequence to compare against afterwards. Their GlyGen
+    # responses go too, or the re-fetch would be answered from the response cache.
+    # Proteins whose known sites did not change are not re-fetched, so a new sequence
+    # alone goes unnoticed until one of their sites changes
+    forget_protein_details(plan.changed_accessions)
+    cache = ProteinCache()
+    for protein_accession in plan.changed_accessions:
+        plan.previous_sequences[protein_accession] = sequence_fingerprint(cache.get(protein_accession))
+    cache.delete_many(plan.changed_accessions)
+    cache.delete_domains({base_accession(protein_accession) for protein_accession in plan.changed_accessions})
+    cache.close()
+
+    logger.info(f"incremental refresh: {len(current)} known sites, {len(plan.changed_accessions)} changed accessions, "
+                f"{len(plan.site_changed_accessions)} with changed site sets")
+    return plan
+
+
+def finish_incremental(plan, logger, known_sites, workers=1, sampling=None, output_path=OUTPUT_PATH):
+    current_accessions = set(known_sites)
+    regenerate = {ac for ac in plan.site_changed_accessions if ac in current_accessions}
+
+    cache = ProteinCache()
+    for protein_accession, fingerprint in plan.previous_sequences.items():
+        if protein_accession in current_accessions and sequence_fingerprint(cache.get(protein_accession)) != fingerprint:
+            regenerate.add(protein_accession)
+    cache.close()
+
+    # Unknown-site rows of untouched proteins are carried over from the previous output
+    with open(plan.previous_path, "r", newline='') as infile, BufferedRowWriter(output_path, "a") as writer:
+        reader = csv.reader(infile, delimiter='\t')
+        header = next(reader, [])
+        accession_index = header.index("uniprotkb_canonical_ac")
+        status_index = header.index("status")
+        for row in reader:
+            if (len(row) > status_index and row[status_index] == UNKNOWN_STATUS
+                    and row[accession_index] in current_accessions and row[accession_index] not in regenerate):
+                writer.writerow(row)
+    reused = writer.rows_written
+
+    logger.info(f"incremental refresh: reused {reused} unknown-site rows, regenerating {len(regenerate)} proteins")
+    sites_data(logger, known_sites, workers, accessions=regenerate, sampling=sampling)
+    os.remove(plan.previous_path)
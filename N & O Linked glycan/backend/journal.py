@@ -0,0 +1,118 @@
+import os
+import json
+import sqlite3
+
+
+JOURNAL_PATH = "./output/journal.sqlite"
+# Output rows written between two committed checkpoints of the known-site stage
+JOURNAL_CHECKPOINT_ROWS = 1000
+# Proteins handled between two committed checkpoints of the unknown-site stage
+SITE_CHECKPOINT_PROTEINS = 500
+
+# Stage the run is in; a resumed run skips every stage before it
+KNOWN_STAGE = "known_sites"
+SITES_STAGE = "unknown_sites"
+EXPORT_STAGE = "export"
+
+
+class RunJournal:
+    """Progress of the current run, committed unit by unit in SQLite.
+
+    The list stage stores every list page it fetched, the glycan stage every
+    glycan it annotated, and the output and unknown-site stages the number of
+    rows (and bytes) of their file that are complete. The proteins and domains
+    of those rows are saved to the protein cache before each output commit.
+    ``--resume`` replays this instead of
+    fetching it again; a run that finishes removes its journal.
+    """
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS list_pages (page_offset INTEGER PRIMARY KEY, items TEXT NOT NULL)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS glycans (glytoucan_ac TEXT PRIMARY KEY, core_fucosylated TEXT, source_tissue TEXT)"
+        )
+
+    def get(self, key, default=None):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def update(self, **values):
+        # Every value of one checkpoint is committed together
+        with self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                ((key, json.dumps(value)) for key, value in values.items()),
+            )
+
+    def list_page(self, offset):
+        row = self._connection.execute("SELECT items FROM list_pages WHERE page_offset = ?", (offset,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_list_page(self, offset, items):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO list_pages (page_offset, items) VALUES (?, ?)", (offset, json.dumps(items))
+        )
+
+    def glycans(self):
+        # glytoucan_ac -> (core_fucosylated, source_tissue), or None for a glycan without expression data
+        rows = self._connection.execute("SELECT glytoucan_ac, core_fucosylated, source_tissue FROM glycans")
+        return {ac: None if source_tissue is None else (core_fucosylated, source_tissue)
+                for ac, core_fucosylated, source_tissue in rows}
+
+    def put_glycans(self, annotations):
+        with self._connection:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO glycans (glytoucan_ac, core_fucosylated, source_tissue) VALUES (?, ?, ?)",
+                ((ac, *(values or (None, None))) for ac, values in annotations.items()),
+            )
+
+    def clear(self):
+        with self._connection:
+            self._connection.execute("BEGIN")
+            for table in ("meta", "list_pages", "glycans"):
+                self._connection.execute(f"DELETE FROM {table}")
+
+    def close(self):
+        self._connection.close()
+
+    def remove(self):
+        self.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+
+def open_run_journal(logger, resume, options=None, path=JOURNAL_PATH):
+    # options: the run options that shape the output; a resumed run has to use the same ones
+    options = json.loads(json.dumps(options or {}))
+    journal = RunJournal(path)
+    if not resume:
+        journal.clear()
+    elif journal.get("stage") is None:
+        logger.info("no journal of an interrupted run found, starting a full run")
+        journal.clear()
+    else:
+        recorded = journal.get("options", {})
+        changed = sorted(name for name in recorded.keys() | options.keys() if recorded.get(name) != options.get(name))
+        if changed:
+            journal.close()
+            raise ValueError(f"--resume needs the options of the interrupted run; changed: "
+                             + ", ".join(f"{name} (was {recorded.get(name)!r}, now {options.get(name)!r})" for name in changed))
+        logger.info(f"resuming the interrupted run at the {journal.get('stage')} stage")
+        return journal
+    journal.update(options=options)
+    return journal
+
+
+def truncate_file(path, size):
+    # Drops whatever was written after the last committed checkpoint
+    with open(path, "r+b") as partial_file:
+        partial_file.truncate(size)
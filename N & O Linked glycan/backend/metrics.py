@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+RUN_REPORT_PATH = "./output/run_report.json"
+PROFILE_DIR = "./output/profiles"
+# Upper bounds (seconds) of the request latency histogram buckets; slower requests go in "+Inf"
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+PROFILE_TOP_FUNCTIONS = 25
+# From Python 3.12 cProfile hooks sys.monitoring, which sees every thread; before that a
+# profiler only sees the thread that enabled it, so executor threads need their own
+PROFILER_COVERS_THREADS = sys.version_info >= (3, 12)
+
+
+def new_host_stats():
+    return {
+        "requests": 0,
+        "errors": 0,
+        "retries": 0,
+        "bytes": 0,
+        "latency_seconds": 0.0,
+        "max_latency_seconds": 0.0,
+        "latency_histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+        "queue_wait_seconds": 0.0,
+        "throttled": 0,
+        "rate_limit_wait_seconds": 0.0,
+        "concurrency_limit": None,
+        "min_concurrency_limit": None,
+        "max_concurrency_limit": None,
+    }
+
+
+def peak_rss_bytes(who):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RunMetrics:
+    """Counters of one run, shared by every stage and thread.
+
+    ``http_client`` records each request attempt per upstream host (and any
+    throttling), the host controllers their concurrency limits, the fetch
+    engine the time spent waiting for a host slot, the caches their hits and
+    misses, and the pipeline the rows and time of each stage. ``report()``
+    turns them into the JSON run report; with ``profile`` set every stage run
+    under ``stage()`` is also profiled with cProfile, along with the calls the
+    fetch engine hands to its executor threads (through ``profiled()``).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, profile=False, profile_dir=PROFILE_DIR):
+        with self._lock:
+            self.profile = profile
+            self.profile_dir = profile_dir
+            self._thread_profilers = None
+            self.started_at = time.time()
+            self.hosts = {}
+            self.caches = {}
+            self.stages = {}
+
+    def _host(self, host):
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = new_host_stats()
+        return stats
+
+    def record_request(self, host, seconds, size=0, ok=True):
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            stats = self._host(host)
+            stats["requests"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["bytes"] += size
+            stats["latency_seconds"] += seconds
+            stats["max_latency_seconds"] = max(stats["max_latency_seconds"], seconds)
+            stats["latency_histogram"][bucket] += 1
+
+    def record_retry(self, host):
+        with self._lock:
+            self._host(host)["retries"] += 1
+
+    def record_wait(self, host, seconds):
+        with self._lock:
+            self._host(host)["queue_wait_seconds"] += seconds
+
+    def record_throttle(self, host):
+        with self._lock:
+            self._host(host)["throttled"] += 1
+
+    def record_rate_wait(self, host, seconds):
+        with self._lock:
+            self._host(host)["rate_limit_wait_seconds"] += seconds
+
+    def record_concurrency(self, host, limit):
+        # Current, lowest and highest in-flight limit the host's controller has set
+        with self._lock:
+            stats = self._host(host)
+            stats["concurrency_limit"] = limit
+            stats["min_concurrency_limit"] = min(limit, stats["min_concurrency_limit"] or limit)
+            stats["max_concurrency_limit"] = max(limit, stats["max_concurrency_limit"] or limit)
+
+    def count_cache(self, cache, outcome, count=1):
+        # outcome: "hits", "misses", or a cache-specific one such as "revalidated"
+        with self._lock:
+            counts = self.caches.setdefault(cache, {})
+            counts[outcome] = counts.get(outcome, 0) + count
+
+    def count_rows(self, stage, count=1):
+        with self._lock:
+            stats = self.stages.setdefault(stage, {"rows": 0, "seconds": 0.0})
+            stats["rows"] += count
+
+    def record_stage_time(self, stage, seconds):
+        with self._lock:
+            stats = self.stages.setdefault(stage, {"rows": 0, "seconds": 0.0})
+            stats["seconds"] += seconds
+
+    @contextmanager
+    def stage(self, name, logger=None):
+        # Times a stage of the run and, in --profile mode, writes its cProfile stats
+        profiler = cProfile.Profile() if self.profile else None
+        start = time.time()
+        if profiler is not None:
+            self._thread_profilers = {}
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                thread_profilers, self._thread_profilers = self._thread_profilers, None
+            self.record_stage_time(name, time.time() - start)
+            if profiler is not None:
+                self._save_profile(name, [profiler, *thread_profilers.values()], logger)
+
+    def profiled(self, func):
+        # Wraps a call run on an executor thread so it shows up in the current stage's profile
+        if not self.profile or PROFILER_COVERS_THREADS:
+            return func
+
+        @functools.wraps(func)
+        def run(*args):
+            thread_profilers = self._thread_profilers
+            if thread_profilers is None:
+                return func(*args)
+            # One profiler per thread, enabled only while the call runs so the stage can read it
+            profiler = thread_profilers.get(threading.get_ident())
+            if profiler is None:
+                profiler = thread_profilers[threading.get_ident()] = cProfile.Profile()
+            profiler.enable()
+            try:
+                return func(*args)
+            finally:
+                profiler.disable()
+        return run
+
+    def _save_profile(self, name, profilers, logger):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profile_path = os.path.join(self.profile_dir, f"{name}.prof")
+        stats = pstats.Stats(*profilers)
+        stats.dump_stats(profile_path)
+        with open(os.path.join(self.profile_dir, f"{name}.txt"), "w") as summary_file:
+            stats.stream = summary_file
+            stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        if logger is not None:
+            logger.info(f"wrote the {name} profile to {profile_path}")
+
+    def report(self, status="completed"):
+        with self._lock:
+            hosts = {}
+            for host, stats in self.hosts.items():
+                stats = dict(stats)
+                stats["mean_latency_seconds"] = stats["latency_seconds"] / stats["requests"] if stats["requests"] else 0.0
+                stats["latency_histogram"] = dict(zip([str(bound) for bound in LATENCY_BUCKETS] + ["+Inf"],
+                                                      stats["latency_histogram"]))
+                hosts[host] = stats
+
+            caches = {}
+            for cache, counts in self.caches.items():
+                counts = dict(counts)
+                lookups = counts.get("hits", 0) + counts.get("misses", 0)
+                counts["hit_ratio"] = counts.get("hits", 0) / lookups if lookups else None
+                caches[cache] = counts
+
+            stages = {}
+            for stage, stats in self.stages.items():
+                stats = dict(stats)
+                stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else None
+                stages[stage] = stats
+
+            return {
+                "status": status,
+                "started_at": self.started_at,
+                "wall_seconds": time.time() - self.started_at,
+                "peak_rss_bytes": peak_rss_bytes(resource.RUSAGE_SELF) if resource else None,
+                "peak_worker_rss_bytes": peak_rss_bytes(resource.RUSAGE_CHILDREN) if resource else None,
+                "hosts": hosts,
+                "caches": caches,
+                "stages": stages,
+            }
+
+    def write_report(self, path=RUN_REPORT_PATH, status="completed"):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "w") as report_file:
+            json.dump(self.report(status), report_file, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+
+metrics = RunMetrics()
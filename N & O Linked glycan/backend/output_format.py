@@ -0,0 +1,118 @@
+import os
+import csv
+import shutil
+import importlib.util
+from .dataset import OUTPUT_PATH, COLUMNS, WRITE_BUFFER_SIZE
+
+# pyarrow is optional and only imported by the columnar writers
+
+
+OUTPUT_FORMATS = ["tsv", "csv", "parquet", "arrow"]
+PARTITION_COLUMNS = ["organism", "taxonomy_id"]
+COLUMNAR_FORMATS = {"parquet", "arrow"}
+OUTPUT_EXTENSIONS = {"tsv": ".tsv", "csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+# Columns whose values repeat across rows (per protein, per site type, per status) are
+# dictionary-encoded; the peptide windows are nearly unique per row and stay plain strings
+PLAIN_COLUMNS = {"peptide_seq_five_before", "peptide_seq_five_after", "peptide_seq_ten_before", "peptide_seq_ten_after"}
+INTEGER_COLUMNS = {"site"}
+READ_BLOCK_SIZE = 16 << 20
+
+
+def output_path_for(output_format, source=OUTPUT_PATH):
+    return os.path.splitext(source)[0] + OUTPUT_EXTENSIONS[output_format]
+
+
+def check_output_format(output_format, partition_by=None):
+    # Called before the run starts, so a missing dependency does not surface after hours of fetching
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"unknown output format {output_format!r}, expected one of {OUTPUT_FORMATS}")
+    if partition_by and output_format not in COLUMNAR_FORMATS:
+        raise ValueError("partitioning is only supported for the parquet and arrow formats")
+    if output_format in COLUMNAR_FORMATS and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(f"the {output_format} output format needs pyarrow: pip install pyarrow")
+
+
+def arrow_schema():
+    import pyarrow as pa
+    fields = []
+    for column in COLUMNS:
+        if column in INTEGER_COLUMNS:
+            fields.append(pa.field(column, pa.int32()))
+        elif column in PLAIN_COLUMNS:
+            fields.append(pa.field(column, pa.string()))
+        else:
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(fields)
+
+
+def open_tsv_batches(source):
+    # Streams the TSV as record batches, decoding the repeated columns straight into dictionaries
+    import pyarrow.csv as pa_csv
+    schema = arrow_schema()
+    return pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(block_size=READ_BLOCK_SIZE),
+        parse_options=pa_csv.ParseOptions(delimiter="\t"),
+        convert_options=pa_csv.ConvertOptions(column_types=schema, include_columns=COLUMNS),
+    )
+
+
+def read_unified_table(source):
+    # The Arrow IPC file format needs one dictionary per column for the whole file.
+    # Dictionary-encoded, the table is a fraction of the TSV's size in memory
+    table = open_tsv_batches(source).read_all()
+    return table.unify_dictionaries()
+
+
+def write_csv(source, destination):
+    with open(source, "r", newline='') as infile, open(destination, "w", newline='', buffering=WRITE_BUFFER_SIZE) as outfile:
+        writer = csv.writer(outfile)
+        for row in csv.reader(infile, delimiter='\t'):
+            writer.writerow(row)
+
+
+def write_parquet(source, destination, partition_by=None):
+    import pyarrow.parquet as pq
+    import pyarrow.dataset as pa_ds
+    batches = open_tsv_batches(source)
+    if partition_by:
+        pa_ds.write_dataset(batches, destination, format="parquet", partitioning=[partition_by],
+                            partitioning_flavor="hive")
+        return
+    with pq.ParquetWriter(destination, batches.schema, use_dictionary=True, compression="zstd") as writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+
+def write_arrow(source, destination, partition_by=None):
+    import pyarrow as pa
+    import pyarrow.dataset as pa_ds
+    table = read_unified_table(source)
+    if partition_by:
+        pa_ds.write_dataset(table, destination, format="ipc", partitioning=[partition_by],
+                            partitioning_flavor="hive")
+        return
+    with pa.ipc.new_file(destination, table.schema) as writer:
+        writer.write_table(table)
+
+
+def export_dataset(logger, output_format, partition_by=None, source=OUTPUT_PATH):
+    # The TSV stays the working copy (--incremental diffs against it); other formats are written next to it
+    if output_format == "tsv":
+        return source
+    destination = output_path_for(output_format, source)
+    # A partitioned export is a directory, a plain one a single file; replace whichever was there
+    if os.path.isdir(destination):
+        shutil.rmtree(destination)
+    elif os.path.isfile(destination):
+        os.remove(destination)
+
+    if output_format == "csv":
+        write_csv(source, destination)
+    elif output_format == "parquet":
+        write_parquet(source, destination, partition_by)
+    else:
+        write_arrow(source, destination, partition_by)
+    logger.info(f"wrote the {output_format} dataset to {destination}")
+    return destination
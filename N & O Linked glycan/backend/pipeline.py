@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+from csv import DictReader, DictWriter
+from .dataset import OUTPUT_PATH, COLUMNS, KNOWN_STATUS
+from .fetch_engine import FetchEngine, HOST_CONCURRENCY, HOST_RATE_LIMIT
+from .protein_cache import open_protein_cache
+from .go_annotations import clear_go_indexes
+from .supersearch_search import iter_supersearch_records, PAGE_SIZE, LIST_WORKERS
+from .protein_details import enrich_proteins, CacheCheckpointer, DomainFetcher, IN_FLIGHT_PER_SLOT
+from .glycan_detail import enrich_glycans
+from .amino_acid_sites import add_known_site, sites_data
+from .incremental import start_incremental, plan_incremental, finish_incremental
+from .output_format import check_output_format, export_dataset
+from .features import export_features, FEATURE_WINDOW
+from .metrics import metrics
+from .journal import open_run_journal, truncate_file, JOURNAL_CHECKPOINT_ROWS, KNOWN_STAGE, SITES_STAGE, EXPORT_STAGE
+
+
+async def replay(records):
+    for record in records:
+        yield record
+
+async def measure_rows(rows, stage, timed=True):
+    # Counts the rows leaving a streaming stage; the stage's time runs from its first pull to its last row
+    start = time.time()
+    async for row in rows:
+        metrics.count_rows(stage)
+        yield row
+    if timed:
+        metrics.record_stage_time(stage, time.time() - start)
+
+async def skip_records(records, count):
+    # Records whose rows a resumed run already has in the output
+    async for record in records:
+        if count > 0:
+            count -= 1
+            continue
+        yield record
+
+def read_known_rows(infile, known_sites):
+    # Rebuilds the per-accession known-site index from rows already written;
+    # the known sites come first in the output, so reading stops at the first unknown one
+    for row in DictReader(infile, delimiter='\t'):
+        if row["status"] != KNOWN_STATUS:
+            break
+        add_known_site(known_sites, row["uniprotkb_canonical_ac"], row["site"], row["protein_name"], row["taxonomy_id"])
+    return known_sites
+
+async def write_dataset(rows, output_path=OUTPUT_PATH, journal=None, before_commit=None):
+    # Output stage: writes each finished row and builds the per-accession
+    # known-site index for the unknown-site stage on the way. before_commit is
+    # awaited before each journal commit of the rows written so far
+    known_sites = {}
+    tmp_path = output_path + ".tmp"
+    written = journal.get("known_rows", 0) if journal is not None else 0
+    if written:
+        # Resumed run: keep the committed rows of the partial file and append after them
+        truncate_file(tmp_path, journal.get("known_offset"))
+        with open(tmp_path, "r", newline='') as infile:
+            read_known_rows(infile, known_sites)
+        outfile = open(tmp_path, "a", newline='')
+        writer = DictWriter(outfile, fieldnames=COLUMNS, delimiter='\t', extrasaction='ignore')
+    else:
+        outfile = open(tmp_path, "w", newline='')
+        writer = DictWriter(outfile, fieldnames=COLUMNS, delimiter='\t', extrasaction='ignore')
+        writer.writeheader()
+
+    with outfile:
+        async for row in rows:
+            writer.writerow(row)
+            add_known_site(known_sites, row["uniprotkb_canonical_ac"], row["site"], row["protein_name"], row["taxonomy_id"])
+            written += 1
+            if journal is not None and written % JOURNAL_CHECKPOINT_ROWS == 0:
+                outfile.flush()
+                if before_commit is not None:
+                    await before_commit()
+                journal.update(known_rows=written, known_offset=outfile.tell())
+    os.replace(tmp_path, output_path)
+    if journal is not None:
+        known_end = os.path.getsize(output_path)
+        journal.update(stage=SITES_STAGE, known_end=known_end, sites_offset=known_end)
+    return known_sites
+
+async def run_stages(logger, cache, engine, page_size, list_workers, plan, journal=None):
+    # list -> protein enrichment -> glycan enrichment -> output, one record at a time
+    # An incremental run diffs against the current list, so it is never served from the response cache
+    records = iter_supersearch_records(engine, logger, page_size, list_workers, journal, cache=plan is None)
+    if plan is not None:
+        # The diff needs the whole list before any accession is enriched
+        records = [record async for record in records]
+        plan_incremental(plan, logger, records)
+        records = replay(records)
+    if journal is not None and journal.get("known_rows", 0):
+        # Replayed from the journaled list pages; none of these rows is enriched again
+        logger.info(f"resuming after {journal.get('known_rows')} committed rows")
+        records = skip_records(records, journal.get("known_rows"))
+    records = measure_rows(records, "list")
+    checkpointer = CacheCheckpointer(cache, engine, logger)
+    domain_fetcher = DomainFetcher(engine, cache)
+    rows = measure_rows(enrich_proteins(records, cache, logger, engine, engine.host_concurrency * IN_FLIGHT_PER_SLOT,
+                                        checkpointer, domain_fetcher), "proteins")
+    rows = measure_rows(enrich_glycans(rows, engine, logger, journal=journal), "glycans")
+
+    async def save_enriched():
+        # A resumed run does not enrich committed rows again, so their proteins and
+        # domains must be in the cache before the rows are committed
+        await domain_fetcher.flush()
+        await checkpointer.flush()
+
+    # The known_sites stage itself is timed by run_pipeline
+    return await write_dataset(measure_rows(rows, "known_sites", timed=False), journal=journal, before_commit=save_enriched)
+
+def journal_options(page_size, workers, sampling):
+    # Options that decide what the output holds or how the unknown-site stage commits its progress
+    return {
+        "page_size": page_size,
+        "workers": workers,
+        "sample_ratios": sampling.ratios if sampling is not None else None,
+        "sample_seed": sampling.seed if sampling is not None else None,
+        "stratify_organism": sampling.stratify_by_organism if sampling is not None else None,
+        "min_site_distance": sampling.min_distance if sampling is not None else None,
+    }
+
+def run_pipeline(logger, use_cache=True, page_size=PAGE_SIZE, list_workers=LIST_WORKERS,
+                 host_concurrency=HOST_CONCURRENCY, workers=1, incremental=False,
+                 output_format="tsv", partition_by=None, features=False, feature_window=FEATURE_WINDOW, one_hot=False,
+                 sampling=None, resume=False, profile=False, rate_limit=HOST_RATE_LIMIT):
+    check_output_format(output_format, partition_by)
+    if resume and incremental:
+        raise ValueError("--resume cannot be combined with --incremental")
+    metrics.reset(profile)
+    # The run report is written whether the run completes or not
+    status = "failed"
+    try:
+        known_sites = run_stage_sequence(logger, use_cache, page_size, list_workers, host_concurrency, rate_limit, workers,
+                                         incremental, output_format, partition_by, features, feature_window, one_hot, sampling, resume)
+        status = "completed"
+    finally:
+        report_path = metrics.write_report(status=status)
+        logger.info(f"wrote the run report to {report_path}")
+    return known_sites
+
+def run_stage_sequence(logger, use_cache, page_size, list_workers, host_concurrency, rate_limit, workers,
+                       incremental, output_format, partition_by, features, feature_window, one_hot, sampling, resume):
+    plan = start_incremental(logger) if incremental else None
+
+    # Incremental runs keep their own baseline file and are not journaled
+    journal = open_run_journal(logger, resume, journal_options(page_size, workers, sampling)) if not incremental else None
+    stage = journal.get("stage") if journal is not None else None
+
+    if stage in (None, KNOWN_STAGE):
+        if journal is not None:
+            journal.update(stage=KNOWN_STAGE)
+        # A resumed run keeps the proteins (and GO indexes) its interrupted attempt already fetched
+        cache = open_protein_cache(use_cache or stage is not None)
+        if not use_cache and stage is None:
+            clear_go_indexes()
+        engine = FetchEngine(host_concurrency, rate_limit)
+        try:
+            with metrics.stage("known_sites", logger):
+                known_sites = asyncio.run(run_stages(logger, cache, engine, page_size, list_workers, plan, journal))
+        finally:
+            engine.close()
+            cache.close()
+    else:
+        with open(OUTPUT_PATH, "r", newline='') as infile:
+            known_sites = read_known_rows(infile, {})
+
+    # Unknown sites are appended after every known site has been written
+    if stage != EXPORT_STAGE:
+        with metrics.stage("unknown_sites", logger):
+            if plan is not None:
+                finish_incremental(plan, logger, known_sites, workers, sampling)
+            else:
+                sites_data(logger, known_sites, workers, sampling=sampling, journal=journal)
+        if journal is not None:
+            journal.update(stage=EXPORT_STAGE)
+
+    with metrics.stage("export", logger):
+        export_dataset(logger, output_format, partition_by)
+    if features:
+        with metrics.stage("features", logger):
+            export_features(logger, feature_window, one_hot)
+    if journal is not None:
+        journal.remove()
+    return known_sites
@@ -0,0 +1,130 @@
+import os
+import json
+import sqlite3
+import threading
+
+
+CACHE_PATH = "./output/cache.sqlite"
+LEGACY_CACHE_PATH = "./output/cache.json"
+
+
+class ProteinCache:
+    """Per-accession protein cache stored in SQLite (WAL mode).
+
+    Every thread gets its own connection, so the fetch engine's executor
+    threads can read and write concurrently, and each
+    ``put`` only writes the row for that accession. The parsed EBI domain
+    intervals are kept alongside, per base accession, so isoforms share them.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS proteins (accession TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS domains (accession TEXT PRIMARY KEY, data TEXT NOT NULL)"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def get(self, accession):
+        row = self._connection().execute(
+            "SELECT data FROM proteins WHERE accession = ?", (accession,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __contains__(self, accession):
+        return self._connection().execute(
+            "SELECT 1 FROM proteins WHERE accession = ?", (accession,)
+        ).fetchone() is not None
+
+    def __getitem__(self, accession):
+        target_data = self.get(accession)
+        if target_data is None:
+            raise KeyError(accession)
+        return target_data
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM proteins").fetchone()[0]
+
+    def put(self, accession, target_data):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO proteins (accession, data) VALUES (?, ?)",
+            (accession, json.dumps(target_data)),
+        )
+
+    def put_many(self, items):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO proteins (accession, data) VALUES (?, ?)",
+                ((accession, json.dumps(target_data)) for accession, target_data in items),
+            )
+
+    def delete_many(self, accessions):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "DELETE FROM proteins WHERE accession = ?", ((accession,) for accession in accessions)
+            )
+
+    def get_domains(self, accession):
+        row = self._connection().execute(
+            "SELECT data FROM domains WHERE accession = ?", (accession,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_domains(self, items):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "INSERT OR REPLACE INTO domains (accession, data) VALUES (?, ?)",
+                ((accession, json.dumps(domains)) for accession, domains in items),
+            )
+
+    def delete_domains(self, accessions):
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "DELETE FROM domains WHERE accession = ?", ((accession,) for accession in accessions)
+            )
+
+    def clear(self):
+        self._connection().execute("DELETE FROM proteins")
+        self._connection().execute("DELETE FROM domains")
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def open_protein_cache(use_cache, path=CACHE_PATH, legacy_path=LEGACY_CACHE_PATH):
+    cache = ProteinCache(path)
+    if not use_cache:
+        cache.clear()
+    elif len(cache) == 0 and os.path.isfile(legacy_path):
+        # One-off import of a cache.json written by earlier versions
+        with open(legacy_path, "r") as cache_file:
+            cache.put_many(json.load(cache_file).items())
+    return cache
@@ -1,50 +1,50 @@
-import requests
-import pandas as pd
-import re
-from functools import reduce
 import time
-import random
-import os
-import logging
-from io import StringIO
-import json
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from csv import DictReader, DictWriter
+import asyncio
+from collections import deque
+from functools import partial
+from urllib.parse import urlencode
+from .http_client import post_json, get_json, evict_response
+from .go_annotations import lookup_go_annotations
+from .fetch_engine import url_host
+from .domains import base_accession, parse_position, build_domain_index, resolve_domains
+from .metrics import metrics
 
 
 DETAIL_URL = "https://api.glygen.org/protein/detail/"
+EBI_PROTEINS_URL = "https://www.ebi.ac.uk/proteins/api/proteins/"
+EBI_FEATURES_URL = "https://www.ebi.ac.uk/proteins/api/features"
+# Accessions per EBI features request (the API's maximum), and how long a
+# partial batch waits for more accessions before it is sent
+DOMAIN_BATCH_SIZE = 100
+DOMAIN_BATCH_SECONDS = 0.05
+CACHE_CHECKPOINT_ROWS = 100
+CACHE_CHECKPOINT_SECONDS = 30
+# Rows queued (fetching or waiting for earlier rows) per unit of host concurrency
+IN_FLIGHT_PER_SLOT = 4
+GLYGEN_HOST = url_host(DETAIL_URL)
+EBI_HOST = url_host(EBI_PROTEINS_URL)
 
 # Function to get protein details and additional data
 #def get_protein_details(protein_accession, max_retries=5):
 def get_protein_details(protein_accession, max_retries=5):
-    retry_delay = 1
-    for attempt in range(max_retries):
-        try:
-            protein_response = requests.post(url=f"{DETAIL_URL}{protein_accession}", json={"uniprotkb_canonical_ac": protein_accession})
-            protein_response.raise_for_status()
-            return protein_response.json()
-        except requests.RequestException:
-            time.sleep(retry_delay)
-            retry_delay *= 2
-            retry_delay += random.uniform(0, 1)
-    raise Exception("Maximum retry attempts reached")
+    return post_json(f"{DETAIL_URL}{protein_accession}", {"uniprotkb_canonical_ac": protein_accession}, max_retries)
+
+def forget_protein_details(protein_accessions):
+    # The next get_protein_details of these accessions asks GlyGen instead of the response cache
+    for protein_accession in protein_accessions:
+        evict_response("POST", f"{DETAIL_URL}{protein_accession}", {"uniprotkb_canonical_ac": protein_accession})
 
 # Function to get protein details and additional data
 def get_domain_details(protein_accession, max_retries=5):
 #def get_domain_details(protein_accession, max_retries=5):
-    retry_delay = 1  # Initial delay in seconds
-    for attempt in range(max_retries):
-        try:
-            protein_response = requests.get(url=f"https://www.ebi.ac.uk/proteins/api/proteins/{protein_accession}", headers={'Accept': 'application/json'})
-            protein_response.raise_for_status()
-            return protein_response.json()
-        except requests.RequestException:
-            print(protein_accession)
-            time.sleep(retry_delay)
-            retry_delay *= 2  # Double the delay for the next attempt
-            retry_delay += random.uniform(0, 1)  # Add jitter
+    # Only the parsed domains are kept (in the protein cache), so the response is not cached
+    return get_json(f"{EBI_PROTEINS_URL}{protein_accession}", max_retries, cache=False)
 
-    raise Exception("Maximum retry attempts reached")
+def get_domain_batch(protein_accessions, max_retries=5):
+    # DOMAIN features of many entries in one call; entries the EBI does not know are left out
+    query = urlencode({"offset": 0, "size": len(protein_accessions), "accession": ",".join(protein_accessions),
+                       "types": "DOMAIN"}, safe=",")
+    return get_json(f"{EBI_FEATURES_URL}?{query}", max_retries, cache=False)
 
 def find_gene_names_and_organism(protein_data):
     gene_name = ""
@@ -71,108 +71,133 @@ def find_gene_names_and_organism(protein_data):
     return gene_name, glytoucan_ac, organism
 
 def find_domain_and_range(domain_data):
-    domain_dict = {}
-    
+    intervals = []
+
     if domain_data.get('features'):
         for d in domain_data['features']:
             if d['type'] == "DOMAIN":
-                begin = d.get('begin')
-                end = d.get('end')
-                end = end.lstrip(">")
-                desc = d.get('description')
-                range = f'{begin}-{end}' 
-                domain_dict[range] = desc
-    return domain_dict
-
-def find_range_and_value(data, value):
-    try:
-        for key, val in data.items():
-            start, end = map(int, key.split('-'))
-            if start <= value <= end:
-                return key, val
-        return "", ""
-    except Exception as e:
-        return '', ''
+                try:
+                    begin = parse_position(d.get('begin'))
+                    end = parse_position(d.get('end'))
+                except ValueError:
+                    continue
+                intervals.append((begin, end, d.get('description')))
+    return build_domain_index(intervals)
+
+def find_range_and_value(domains, value):
+    # Every domain covering the site, joined in start order
+    return resolve_domains(domains, [value])[0]
 
 
 # Function to find GO annotations
 
 def find_go_annotations(protein_accession, organism):
-    linked_csv_files = {
-        'Homo sapiens': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/human_protein_go_annotation.csv',
-        'Mus musculus': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/mouse_protein_go_annotation.csv',
-        'Gallus gallus': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/chicken_protein_go_annotation.csv',
-        'Dictyostelium discoideum': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/dicty_protein_go_annotation.csv',
-        'Drosophila melanogaster': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/fruitfly_protein_go_annotation.csv',
-        'Hepacivirus C genotype 1a': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/hcv1a_protein_go_annotation.csv',
-        'Hepacivirus C genotype 1b': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/hcv1b_protein_go_annotation.csv',
-        'Sus scrofa': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/pig_protein_go_annotation.csv',
-        'Rattus norvegicus': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/rat_protein_go_annotation.csv',
-        'Severe acute respiratory syndrome coronavirus 1': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/sarscov1_protein_go_annotation.csv',
-        'Severe acute respiratory syndrome coronavirus 2': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/sarscov2_protein_go_annotation.csv',
-        'Saccharomyces cerevisiae S288C': 'https://data.glygen.org/ln2data/releases/data/current/reviewed/yeast_protein_go_annotation.csv'
-    }
+    # Served from the per-organism index, which is built once from the GlyGen CSV
+    return lookup_go_annotations(protein_accession, organism)
 
-    logger = logging.getLogger(__name__)
-    
-    link = linked_csv_files.get(organism)
-    if not link:
-        logger.error(f"No CSV file link found for organism: {organism}")
-        return '', '', ''
-
-    try:
-        response = requests.get(link, verify=True)  # Ensure SSL verification
-        response.raise_for_status()  # Raise an exception for bad responses
-
-        # Use StringIO to convert the response content to a file-like object
-        csv_data = response.content.decode('utf-8')
-        linked_df = pd.read_csv(StringIO(csv_data))  # Read CSV from string
-    except Exception as e:
-        logger.error(f"Error reading CSV file for organism: {organism} from link: {link}. Error: {e}")
-        return '', '', ''
-    biological_list, molecular_list, cellular_list = [], [], []
-    categories = ["molecular_function", "biological_process", "cellular_component"]
-
-    try:
-        matched_df = linked_df[linked_df['uniprotkb_canonical_ac'] == protein_accession]
-    except Exception as e:
-        logger.error(f"Error reading CSV file for organism: {organism} from link: {link}. Error: {e}")
-        return '', '', ''
-
-    matched_df.loc[:, 'go_term_id'] = matched_df['go_term_id'].astype(str).str.replace('_', ':')
-    for category in categories:  # extracting info based on categories into the corresponding list
-        go_terms = matched_df.loc[matched_df['go_term_category'] == category, ['go_term_label', 'go_term_id']]
-        if category == "molecular_function":
-            for index, row in go_terms.iterrows():
-                molecular_list.append(f"{row['go_term_label']} ({row['go_term_id']})")
-        elif category == "biological_process":
-            for index, row in go_terms.iterrows():
-                biological_list.append(f"{row['go_term_label']} ({row['go_term_id']})")
-        elif category == "cellular_component":
-            for index, row in go_terms.iterrows():
-                cellular_list.append(f"{row['go_term_label']} ({row['go_term_id']})")
-
-    return '; '.join(map(str, molecular_list)), '; '.join(map(str, biological_list)), '; '.join(map(str, cellular_list))
-
-def process_protein(row, cache, logger):
-    start_time = time.time()
-    uniprot = row["uniprotkb_canonical_ac"]
-    protein_ac = uniprot.replace("-1", "")
-    protein_ac = re.sub(r'-\d+', '', protein_ac)
-    protein_data = get_protein_details(uniprot, max_retries=5) # Your function to fetch protein details
-    gene_name, glytoucan_ac, organism = find_gene_names_and_organism(protein_data)  # Your function to find gene names and kinases
-    molecular_function, biological_process, cellular_component = find_go_annotations(uniprot, organism)  # Your function to find GO annotations
-    if protein_ac:
+def fill_row(row, target_data, domains):
+    row["gene_name"] = target_data["gene_name"]
+    row["glytoucan_ac"] = target_data["glytoucan_ac"]
+    row['organism'] = target_data['organism']
+    row["molecular_function"] = target_data["molecular_function"]
+    row["biological_process"] = target_data["biological_process"]
+    row["cellular_component"] = target_data["cellular_component"]
+    range, domain = find_range_and_value(domains, int(row['site']))
+    row["range"] = range
+    row["domain"] = domain
+    return row
+
+class DomainFetcher:
+    """Domain indexes by base accession, fetched from the EBI in batches.
+
+    Isoforms and repeated rows of an entry share one lookup. Entries missing
+    from the cache's domains table queue up and go out in one features request
+    once ``batch_size`` are waiting or ``batch_seconds`` have passed, and only
+    their parsed intervals are saved back to the cache. A failed lookup is not
+    saved, so the next run asks for it again.
+    """
+
+    def __init__(self, engine, cache, batch_size=DOMAIN_BATCH_SIZE, batch_seconds=DOMAIN_BATCH_SECONDS):
+        self.engine = engine
+        self.cache = cache
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self._lookups = {}
+        self._queued = []
+        self._timer = None
+        self._tasks = set()
+
+    def get(self, protein_ac):
+        # Future of the entry's domain index
+        if not protein_ac:
+            lookup = asyncio.get_running_loop().create_future()
+            lookup.set_result(build_domain_index([]))
+            return lookup
+        lookup = self._lookups.get(protein_ac)
+        if lookup is not None:
+            metrics.count_cache("domains", "shared")
+            return lookup
+        lookup = self._lookups[protein_ac] = asyncio.get_running_loop().create_future()
+        domains = self.cache.get_domains(protein_ac)
+        if domains is not None:
+            metrics.count_cache("domains", "hits")
+            lookup.set_result(domains)
+            return lookup
+        metrics.count_cache("domains", "misses")
+        self._queued.append(protein_ac)
+        if len(self._queued) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_seconds, self._flush)
+        return lookup
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._queued = self._queued, []
+        if batch:
+            task = asyncio.create_task(self._fetch_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch_batch(self, batch):
+        try:
+            entries = await self.engine.run(EBI_HOST, get_domain_batch, batch, 5)
+            found = {entry.get("accession"): find_domain_and_range(entry) for entry in entries}
+        except Exception:
+            # One bad accession fails the whole batch, so every entry is asked for on its own
+            found = {}
+        # A secondary accession comes back under its primary one, so ask for those on their own too
+        missing = [protein_ac for protein_ac in batch if protein_ac not in found]
+        found.update(zip(missing, await asyncio.gather(*(self._fetch_one(protein_ac) for protein_ac in missing))))
+        for protein_ac in batch:
+            # Rows of a failed lookup get an empty index; it is not saved, so a later run retries it
+            self._lookups[protein_ac].set_result(found[protein_ac] or build_domain_index([]))
+        await self.engine.run_local(self.cache.put_domains,
+                                    [(protein_ac, found[protein_ac]) for protein_ac in batch if found[protein_ac] is not None])
+
+    async def flush(self):
+        # Waits for the batches still saving their domains to the cache
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    async def _fetch_one(self, protein_ac):
+        # The entry's domain index, an empty one if the EBI has no such entry, or None if the lookup failed
         try:
-            domain_data = get_domain_details(protein_ac, max_retries=5)
-            domain_dict = find_domain_and_range(domain_data)
-            range, domain = find_range_and_value(domain_dict, int(row['site']))
+            return find_domain_and_range(await self.engine.run(EBI_HOST, get_domain_details, protein_ac, 5))
         except Exception as e:
-            domain = ''
-            range = ''
-            domain_dict = {}
+            if getattr(getattr(e, "response", None), "status_code", None) == 404:
+                return build_domain_index([])
+            return None
+
+async def fetch_protein(uniprot, logger, engine):
+    start_time = time.time()
+
+    protein_data = await engine.run(GLYGEN_HOST, get_protein_details, uniprot, 5)
     gene_name, glytoucan_ac, organism = find_gene_names_and_organism(protein_data)
-    molecular_function, biological_process, cellular_component = find_go_annotations(uniprot, organism)
+    # May load the organism's GO index on first use, so keep it off the event loop
+    molecular_function, biological_process, cellular_component = await engine.run_local(find_go_annotations, uniprot, organism)
     fasta_seq = protein_data["sequence"]['sequence']
 
     target_data = {
@@ -183,108 +208,147 @@ def process_protein(row, cache, logger):
         "biological_process": biological_process,
         "cellular_component": cellular_component,
         "fasta_seq": fasta_seq,
-        "domain_dict" : domain_dict
     }
 
-    row["gene_name"] = gene_name
-    row["glytoucan_ac"] = target_data["glytoucan_ac"]
-    row['organism'] = organism
-    row["molecular_function"] = molecular_function
-    row["biological_process"] = biological_process
-    row["cellular_component"] = cellular_component
-    row["range"] = range
-    row["domain"] = domain
-
     logger.info(f"Processed {uniprot} in {time.time() - start_time} seconds")
 
-    with open("./output/cache.json", "w") as cache_file:
-        json.dump(cache, cache_file)
-
-    return row, target_data
-
-def get_all_protein_data(use_cache, logger):
-    
-    if use_cache and os.path.isfile("./output/cache.json"):
-         with open("./output/cache.json", "r") as cache_file:
-            cache = json.load(cache_file)
-    else:
-        cache = {}
-
-    cache_checkpoint = 100
-# Write initial headers to the output file
-    columns = [ "uniprotkb_canonical_ac", "protein_name","gene_name", "site", "amino_acid","glycosylation_type", 
-                 "glycosylation_subtype", "glytoucan_ac", "reducing_end_monosaccharide",
-                "core_fucosylated", "source_tissue", "peptide_seq_five_before", "peptide_seq_five_after", 
-                "peptide_seq_ten_before","peptide_seq_ten_after","organism", "taxonomy_id","molecular_function",
-                "biological_process","cellular_component","domain", "range", "status"]
-
-    outfile_path = "./output/supersearch_results.tsv"
-
-    with open(outfile_path, "r") as infile, open(outfile_path + ".tmp", "w", newline='') as outfile:
-        reader = DictReader(infile, delimiter='\t')
-        writer = DictWriter(outfile, fieldnames=columns, delimiter='\t')
-        writer.writeheader()
-        api_hit = 0
-#######
-        # Use ThreadPoolExecutor for concurrent API requests
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
-
-            for i, row in enumerate(reader):
-
-                uniprot = row["uniprotkb_canonical_ac"]
-                if uniprot in cache:
-                    target_data = cache[uniprot]
-                    row["gene_name"] = target_data["gene_name"]
-                    row["glytoucan_ac"] = target_data["glytoucan_ac"]
-                    row['organism'] = target_data['organism']
-                    row["molecular_function"] = target_data["molecular_function"]
-                    row["biological_process"] = target_data["biological_process"]
-                    row["cellular_component"] = target_data["cellular_component"]
-                    range, domain = find_range_and_value(target_data['domain_dict'], int(row['site']))
-                    row["range"] = range
-                    row["domain"] = domain
-                    writer.writerow(row)
-                else:
-                    # Submit the task to the executor
-                    futures.append(executor.submit(process_protein, row, cache, logger))
-                
-                if i % cache_checkpoint == 0:
-                    results = [future.result() for future in as_completed(futures)]
-                    for row, target_data in results:
-                        writer.writerow(row)
-                        cache[row["uniprotkb_canonical_ac"]] = target_data
-                        api_hit += 1
-
-                    # Clear the futures list after processing
-                    futures.clear()
-
-                    # Save the cache to file
-                    with open("./output/cache.json", "w") as cache_file:
-                        json.dump(cache, cache_file)
-                    
-                    logger.info("Hit checkpoint at index " + str(i))
-                    logger.info("API calls " + str(api_hit))
-                    logger.info("cache hits " + str(cache_checkpoint - api_hit))
-                    logger.info("============================================")
-                
-                    api_hit = 0
-
-            if futures:
-                results = [future.result() for future in as_completed(futures)]
-                for row, target_data in results:
-                    writer.writerow(row)
-                    cache[row["uniprotkb_canonical_ac"]] = target_data
-                    api_hit += 1
-
-            # Clear futures list after final processing
-            futures.clear()
-
-    # Replace the original file with the updated file
-    os.replace(outfile_path + ".tmp", outfile_path) # Replace the original file with the updated fil
-
-    # Save cache
-    with open("./output/cache.json", "w") as cache_file:
-        json.dump(cache, cache_file)
-
-
+    return target_data
+
+class CacheCheckpointer:
+    """Collects fetched proteins and saves them to the cache in the background.
+
+    A checkpoint starts once ``checkpoint_rows`` proteins are waiting or
+    ``checkpoint_seconds`` have passed, and runs on the engine's executor
+    while new work keeps being submitted. ``flush()`` saves everything added
+    so far, for callers that must not get ahead of the cache.
+    """
+
+    def __init__(self, cache, engine, logger, on_saved=None, checkpoint_rows=CACHE_CHECKPOINT_ROWS, checkpoint_seconds=CACHE_CHECKPOINT_SECONDS):
+        self.cache = cache
+        self.on_saved = on_saved
+        self.engine = engine
+        self.logger = logger
+        self.checkpoint_rows = checkpoint_rows
+        self.checkpoint_seconds = checkpoint_seconds
+        self.unsaved = []
+        self.api_hit = 0
+        self.cache_hit = 0
+        self._task = None
+        self._last_checkpoint = time.time()
+
+    def add(self, uniprot, target_data):
+        self.unsaved.append((uniprot, target_data))
+        self.api_hit += 1
+
+    def maybe_checkpoint(self, index):
+        due = (len(self.unsaved) >= self.checkpoint_rows
+               or time.time() - self._last_checkpoint >= self.checkpoint_seconds)
+        if not due or not self.unsaved or (self._task is not None and not self._task.done()):
+            return
+        if self._task is not None:
+            self._task.result()  # surface a failed save
+        batch, self.unsaved = self.unsaved, []
+        self._task = asyncio.create_task(self._save(batch))
+        self._last_checkpoint = time.time()
+
+        self.logger.info("Hit checkpoint at index " + str(index))
+        self.logger.info("API calls " + str(self.api_hit))
+        self.logger.info("cache hits " + str(self.cache_hit))
+        self.logger.info("============================================")
+        self.api_hit = 0
+        self.cache_hit = 0
+
+    async def _save(self, batch):
+        await self.engine.run_local(self.cache.put_many, batch)
+        if self.on_saved is not None:
+            self.on_saved(uniprot for uniprot, _ in batch)
+
+    async def flush(self):
+        # Proteins are added from their fetch's done callback, which may still be queued
+        # behind a row of that protein that has already been passed on; let it run first
+        await asyncio.sleep(0)
+        if self._task is not None:
+            await self._task
+        if self.unsaved:
+            batch, self.unsaved = self.unsaved, []
+            self._task = asyncio.create_task(self._save(batch))
+            await self._task
+
+    async def close(self):
+        await self.flush()
+
+async def enrich_proteins(rows, cache, logger, engine, max_in_flight, checkpointer=None, domain_fetcher=None):
+    # Protein stage of the pipeline. Rows leave in input order: each queued row
+    # carries its protein's data, or the task fetching it, and the lookup of its
+    # entry's domains (kept apart from the protein data), and the head of the
+    # queue is passed on as soon as it is ready. Pulling from upstream only
+    # waits when max_in_flight rows are queued. Fetched proteins and domains are
+    # saved through checkpointer and domain_fetcher, which a downstream stage may flush.
+    pending = deque()
+    # One fetch per accession: rows for a protein that is still being fetched,
+    # or fetched but not yet saved to the cache, share that protein's task
+    fetching = {}
+
+    def forget_saved(accessions):
+        for uniprot in accessions:
+            fetching.pop(uniprot, None)
+
+    if checkpointer is None:
+        checkpointer = CacheCheckpointer(cache, engine, logger)
+    checkpointer.on_saved = forget_saved
+    if domain_fetcher is None:
+        domain_fetcher = DomainFetcher(engine, cache)
+
+    def waiting_on(item):
+        _, entry, domains = item
+        return [future for future in (entry, domains) if not isinstance(future, dict) and not future.done()]
+
+    def head_ready():
+        return pending and not waiting_on(pending[0])
+
+    def pop_head():
+        row, entry, domains = pending.popleft()
+        return fill_row(row, entry if isinstance(entry, dict) else entry.result(), domains.result())
+
+    def on_fetched(uniprot, task):
+        if not task.cancelled() and task.exception() is None:
+            checkpointer.add(uniprot, task.result())
+
+    i = -1
+    async for row in rows:
+        i += 1
+
+        uniprot = row["uniprotkb_canonical_ac"]
+        task = fetching.get(uniprot)
+        target_data = cache.get(uniprot) if task is None else None
+        # The GlyGen detail and EBI domain requests of a new protein go out together
+        domains = domain_fetcher.get(base_accession(uniprot))
+        if target_data is not None:
+            pending.append((row, target_data, domains))
+            checkpointer.cache_hit += 1
+            metrics.count_cache("protein", "hits")
+        else:
+            if task is None:
+                metrics.count_cache("protein", "misses")
+                task = fetching[uniprot] = asyncio.create_task(fetch_protein(uniprot, logger, engine))
+                task.add_done_callback(partial(on_fetched, uniprot))
+            else:
+                # Joins the fetch already running (or not yet saved) for this accession
+                metrics.count_cache("protein", "shared")
+            pending.append((row, task, domains))
+
+        while head_ready():
+            yield pop_head()
+        while len(pending) >= max_in_flight:
+            await asyncio.wait(waiting_on(pending[0]))
+            while head_ready():
+                yield pop_head()
+        checkpointer.maybe_checkpoint(i)
+
+    while pending:
+        if not head_ready():
+            await asyncio.wait(waiting_on(pending[0]))
+        yield pop_head()
+        checkpointer.maybe_checkpoint(i)
+    await domain_fetcher.flush()
+    await checkpointer.close()
@@ -0,0 +1,177 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from .metrics import metrics
+
+
+# Most in-flight requests allowed per upstream host (-c); the controller stays at or below it
+HOST_CONCURRENCY = 100
+# Requests per second per host (--rate-limit); 0 leaves the pace to the concurrency limit alone
+HOST_RATE_LIMIT = 0
+# In-flight requests a host starts with before it has shown how much it can take
+INITIAL_CONCURRENCY = 8
+MIN_CONCURRENCY = 1
+
+# Statuses a host sends when it is throttling us or is overloaded
+THROTTLE_STATUSES = (429, 503)
+# Longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 300
+
+# Multiplicative decrease when throttled or failing, and when the latency climbs
+THROTTLE_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.9
+# Smoothed latency above this multiple of the host's baseline counts as congestion
+LATENCY_TOLERANCE = 2.0
+# Smoothed share of failed requests above which the host counts as failing
+ERROR_RATE_TOLERANCE = 0.05
+# Weight of the newest request in the smoothed latency, error rate and baseline
+LATENCY_SMOOTHING = 0.1
+ERROR_SMOOTHING = 0.02
+BASELINE_DRIFT = 0.01
+
+
+def retry_after_seconds(value):
+    # Retry-After holds either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class HostController:
+    """Concurrency limit and request pace of one upstream host.
+
+    The limit starts at ``INITIAL_CONCURRENCY`` and grows by one per successful
+    request until the first sign of congestion, then by one per ``limit``
+    successful requests (additive increase). A 429, an error rate above
+    ``ERROR_RATE_TOLERANCE`` or a smoothed latency well above the host's
+    baseline cut it multiplicatively, at most once per round trip. Every
+    attempt first takes a token from the host's bucket, so a Retry-After
+    pauses all threads talking to the host.
+    """
+
+    def __init__(self, host, max_concurrency=HOST_CONCURRENCY, rate=HOST_RATE_LIMIT):
+        self.host = host
+        self.max_concurrency = max(MIN_CONCURRENCY, max_concurrency)
+        self.limit = float(min(INITIAL_CONCURRENCY, self.max_concurrency))
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._slow_start = True
+        self._latency = None
+        self._base_latency = None
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+        # Token bucket: holds up to one second of requests
+        self._burst = max(1.0, rate)
+        self._tokens = self._burst
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        metrics.record_concurrency(host, self.concurrency)
+
+    @property
+    def concurrency(self):
+        return max(MIN_CONCURRENCY, int(self.limit))
+
+    def acquire(self):
+        # Blocks until another request may go to the host; returns the seconds waited
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._paused_until - now
+                if delay <= 0:
+                    if not self.rate:
+                        return waited
+                    self._tokens = min(self._burst, self._tokens + max(0.0, now - self._refilled_at) * self.rate)
+                    self._refilled_at = max(now, self._refilled_at)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+                    delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def record_success(self, seconds):
+        with self._lock:
+            self._error_rate *= 1 - ERROR_SMOOTHING
+            if self._latency is None:
+                self._latency = self._base_latency = seconds
+            else:
+                self._latency += LATENCY_SMOOTHING * (seconds - self._latency)
+                # The baseline follows the lowest latency seen, drifting up if the host stays slower
+                self._base_latency = min(self._latency, self._base_latency + BASELINE_DRIFT * (self._latency - self._base_latency))
+            if self._latency > LATENCY_TOLERANCE * self._base_latency:
+                self._decrease(LATENCY_BACKOFF)
+            elif self._slow_start:
+                self._set_limit(self.limit + 1)
+            else:
+                self._set_limit(self.limit + 1 / self.limit)
+
+    def record_failure(self):
+        # A 5xx, a timeout or a dropped connection; cuts the limit once they stop being rare
+        with self._lock:
+            self._count_failure()
+
+    def record_throttle(self, status, retry_after=None):
+        # A 429, or a 503 with a Retry-After, is the host asking us to slow down: the limit is
+        # cut at once and nothing more is sent to the host until the Retry-After has passed
+        with self._lock:
+            if status != 429 and retry_after is None:
+                return self._count_failure()
+            self._error_rate += ERROR_SMOOTHING * (1 - self._error_rate)
+            self._decrease(THROTTLE_BACKOFF)
+            if retry_after:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                self._tokens = 0.0
+                self._refilled_at = self._paused_until
+
+    def _count_failure(self):
+        self._error_rate += ERROR_SMOOTHING * (1 - self._error_rate)
+        if self._error_rate > ERROR_RATE_TOLERANCE:
+            self._decrease(THROTTLE_BACKOFF)
+
+    def _decrease(self, factor):
+        # Requests already in flight saw the same congestion, so cut once per round trip
+        now = time.monotonic()
+        if now - self._last_decrease < (self._latency or 0.0):
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        self._set_limit(self.limit * factor)
+
+    def _set_limit(self, limit):
+        before = self.concurrency
+        self.limit = min(float(self.max_concurrency), max(float(MIN_CONCURRENCY), limit))
+        if self.concurrency != before:
+            metrics.record_concurrency(self.host, self.concurrency)
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+_max_concurrency = HOST_CONCURRENCY
+_rate_limit = HOST_RATE_LIMIT
+
+
+def configure_rate_control(max_concurrency=HOST_CONCURRENCY, rate=HOST_RATE_LIMIT):
+    # Starts every host over from INITIAL_CONCURRENCY with the given bounds
+    global _max_concurrency, _rate_limit
+    with _controllers_lock:
+        _max_concurrency = max_concurrency
+        _rate_limit = rate
+        _controllers.clear()
+
+
+def host_controller(host):
+    controller = _controllers.get(host)
+    if controller is None:
+        with _controllers_lock:
+            controller = _controllers.get(host)
+            if controller is None:
+                controller = _controllers[host] = HostController(host, _max_concurrency, _rate_limit)
+    return controller
@@ -0,0 +1,87 @@
+import os
+import json
+import time
+import hashlib
+
+
+HTTP_CACHE_DIR = "./output/http_cache"
+HTTP_CACHE_TTL = 24 * 60 * 60  # seconds
+
+
+class ResponseCache:
+    """On-disk cache of HTTP response bodies, keyed by method, URL and payload hash.
+
+    Each entry is a body file plus a small JSON file holding the time it was
+    stored and the ETag / Last-Modified validators. Entries younger than
+    ``ttl`` are served without a request; older ones are revalidated with a
+    conditional request when the server sent validators. ``revalidate=True``
+    treats every entry as stale (used by ``--nocache``).
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR, ttl=HTTP_CACHE_TTL, revalidate=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.revalidate = revalidate
+
+    def key(self, method, url, payload=None):
+        payload_text = json.dumps(payload, sort_keys=True, separators=(",", ":")) if payload is not None else ""
+        return hashlib.sha256(f"{method.upper()} {url}\n{payload_text}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".json", base + ".body"
+
+    def load(self, key):
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+            with open(body_path, "rb") as body_file:
+                body = body_file.read()
+        except (OSError, ValueError):
+            return None, None
+        return meta, body
+
+    def is_fresh(self, meta):
+        return not self.revalidate and time.time() - meta["stored_at"] < self.ttl
+
+    @staticmethod
+    def validators(meta):
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def _write(self, path, data, mode):
+        with open(path + ".tmp", mode) as out_file:
+            out_file.write(data)
+        os.replace(path + ".tmp", path)
+
+    def store(self, key, url, response):
+        meta_path, body_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta = {
+            "url": url,
+            "stored_at": time.time(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        # Body first, so a meta file never points at a missing body
+        self._write(body_path, response.content, "wb")
+        self._write(meta_path, json.dumps(meta), "w")
+
+    def touch(self, key, meta):
+        # The server answered 304: the stored body is still current
+        meta_path, _ = self._paths(key)
+        meta = dict(meta, stored_at=time.time())
+        self._write(meta_path, json.dumps(meta), "w")
+
+    def evict(self, key):
+        # Meta first, so a body without its meta file is simply never read
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,68 @@
+import random
+from collections import Counter
+
+
+# Residue keys of the sampling ratios: the S/T/Y candidates and "N" for the N-glycosylation sequons
+SAMPLE_RESIDUES = ["S", "T", "Y", "N"]
+SAMPLE_SEED = 0
+
+
+def parse_sample_ratios(text):
+    # "S=2,T=2,Y=0.5" -> {"S": 2.0, "T": 2.0, "Y": 0.5}; residues not listed are kept in full
+    ratios = {}
+    for item in text.split(","):
+        residue, _, ratio = item.partition("=")
+        residue = residue.strip().upper()
+        if residue not in SAMPLE_RESIDUES or not ratio:
+            raise ValueError(f"expected RESIDUE=RATIO with RESIDUE one of {SAMPLE_RESIDUES}, got {item!r}")
+        ratios[residue] = float(ratio)
+    return ratios
+
+
+class NegativeSampling:
+    """Which unknown sites the scanner keeps.
+
+    ``ratios`` gives, per residue key, the number of unknown sites to keep per
+    known site. The scanner turns it into a keep probability from the candidate
+    counts, computed over the whole proteome or per organism when
+    ``stratify_by_organism`` is set. Every protein draws from its own generator
+    seeded with ``seed`` and its accession, so a sample does not depend on how
+    the proteins are split across workers. ``min_distance`` drops candidates
+    closer than that many residues to a known site of the same protein.
+    """
+
+    def __init__(self, ratios=None, seed=SAMPLE_SEED, stratify_by_organism=False, min_distance=0):
+        self.ratios = dict(ratios or {})
+        self.seed = seed
+        self.stratify_by_organism = stratify_by_organism
+        self.min_distance = min_distance
+        # stratum -> residue key -> keep probability, filled by plan()
+        self.probabilities = {}
+
+    def stratum(self, organism):
+        return organism if self.stratify_by_organism else ""
+
+    def plan(self, candidate_counts, known_counts):
+        # candidate_counts: (stratum, residue key) -> candidates left after the distance filter
+        # known_counts: stratum -> known sites
+        self.probabilities = {}
+        for (stratum, residue), candidates in candidate_counts.items():
+            if residue not in self.ratios or not candidates:
+                continue
+            wanted = self.ratios[residue] * known_counts.get(stratum, 0)
+            self.probabilities.setdefault(stratum, {})[residue] = min(1.0, wanted / candidates)
+
+    def keep_probability(self, organism):
+        return self.probabilities.get(self.stratum(organism), {})
+
+    def rng(self, protein_accession):
+        return random.Random(f"{self.seed}:{protein_accession}")
+
+
+def merge_counts(counts):
+    # Sums the (candidate, known) counters returned by the counting shards
+    candidate_counts, known_counts = Counter(), Counter()
+    for candidates, known in counts:
+        candidate_counts.update(candidates)
+        known_counts.update(known)
+    return candidate_counts, known_counts
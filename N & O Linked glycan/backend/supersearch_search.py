@@ -1,21 +1,17 @@
-import requests
-import pandas as pd
-import sys
-import re
-from functools import reduce
-import time
-import random
-import os
-import logging
-from io import StringIO
-from csv import DictReader, DictWriter
+import asyncio
+from collections import deque
+from itertools import islice
+from .dataset import KNOWN_STATUS
+from .http_client import post_json
+from .fetch_engine import url_host
 
 # Define URLs and payloads
 SEARCH_URL = "https://beta-api.glygen.org/supersearch/search"
 LIST_URL = "https://beta-api.glygen.org/supersearch/list/"
-GLYCAN_URL = "https://beta-api.glygen.org/glycan/detail/"
-OUTPUT_PATH = "./output/supersearch_results.tsv"
-REDENDMONO_URL = "https://github.com/glygen-glycan-data/PyGly/raw/master/smw/glycandata/export/redendmono.tsv"
+
+PAGE_SIZE = 100
+LIST_WORKERS = 8
+SEARCH_HOST = url_host(SEARCH_URL)
 
 PAYLOAD = {
     "concept_query_list": [
@@ -37,28 +33,18 @@ PAYLOAD = {
     ]
 }
 
-def supersearch_search():
-    response = requests.post(url=SEARCH_URL, json=PAYLOAD)
-    search_data = response.json()  # converting response to a json file
+def supersearch_search(cache=True):
+    # The search creates the list and reports its length. Like the list pages it is served from
+    # the response cache while that is fresh, so a fully cached run makes no request at all
+    search_data = fetch_with_backoff(SEARCH_URL, PAYLOAD, cache=cache)
     list_id = search_data["results_summary"]["site"]["list_id"]  # obtaining the id
-    list_res = requests.post(LIST_URL, json={"id":list_id})
-    list_data = list_res.json()
+    list_data = fetch_with_backoff(LIST_URL, {"id": list_id}, cache=cache)
     total_length = list_data["pagination"]["total_length"]
     return total_length, list_id
 
 # Function to make API calls with exponential backoff
-def fetch_with_backoff(url, payload, max_retries=5):
-    retry_delay = 1
-    for attempt in range(max_retries):
-        try:
-            response = requests.post(url, json=payload)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException:
-            time.sleep(retry_delay)
-            retry_delay *= 2
-            retry_delay += random.uniform(0, 1)
-    raise Exception("Maximum retry attempts reached")
+def fetch_with_backoff(url, payload, max_retries=5, cache=True):
+    return post_json(url, payload, max_retries, cache)
 
 
 
@@ -94,49 +80,52 @@ def extract_data_from_item(item):
             "cellular_component": "",  # Placeholder for later population
             "domain":  "",  # Placeholder for later population
             "range":  "",  # Placeholder for later population
-            "status": "known_glycosite",  # Add the status field
+            "status": KNOWN_STATUS,  # Add the status field
 
     }
 
-# Initial API call to get the list_id
-search_data = fetch_with_backoff(SEARCH_URL, PAYLOAD)
-list_id = search_data["results_summary"]["site"]["list_id"]
-
-def all_supersearch_list_data(use_cache, logger):
-    if os.path.isfile("./output/supersearch_results.tsv") and use_cache:
-        logger.info("found cache file")
-        return
-    
-    logger.info("overwriting cache")
-    limit = 100
-    offset = 1
-    total_length, list_id = supersearch_search()
-
-# Write initial headers to the output file
-    columns = [ "uniprotkb_canonical_ac", "protein_name", "gene_name", "site", "amino_acid", "glycosylation_type",
-                "glycosylation_subtype", "glytoucan_ac", "reducing_end_monosaccharide",
-                "core_fucosylated", "source_tissue", "peptide_seq_five_before", "peptide_seq_five_after", 
-                "peptide_seq_ten_before", "peptide_seq_ten_after","organism", "taxonomy_id","molecular_function",
-                "biological_process","cellular_component", "domain", "range", "status"]
-   
-    with open(OUTPUT_PATH, 'w', newline='') as outfile:
-        writer = DictWriter(outfile, fieldnames=columns, delimiter='\t')
-        writer.writeheader()
-
-# Fetch data and write rows
-    while offset < 100:
-    #while offset < total_length:
-        list_payload = {"id": list_id, "offset": offset, "sort": "hit_score", "limit": limit, "order": "desc", "filters": []}
-        full_list_data = fetch_with_backoff(LIST_URL, list_payload, max_retries=5)
-        filtered_list = [item for item in full_list_data['results'] if "S-linked glycosylation" not in item.get("S-linked", "") and "C-linked glycosylation" not in item.get("C-linked", "")]
-
-        with open(OUTPUT_PATH, 'a', newline='') as outfile:
-            writer = DictWriter(outfile, fieldnames=columns, delimiter='\t')
-            for item in filtered_list:
-                extracted_data = extract_data_from_item(item)
-                writer.writerow(extracted_data)
-
-        offset += limit
-        print(f"Processed up to offset: {offset}")
-
-
+def fetch_list_page(list_id, offset, limit, cache=True):
+    list_payload = {"id": list_id, "offset": offset, "sort": "hit_score", "limit": limit, "order": "desc", "filters": []}
+    full_list_data = fetch_with_backoff(LIST_URL, list_payload, max_retries=5, cache=cache)
+    return [item for item in full_list_data['results'] if "S-linked glycosylation" not in item.get("S-linked", "") and "C-linked glycosylation" not in item.get("C-linked", "")]
+
+async def iter_supersearch_records(engine, logger, page_size=PAGE_SIZE, max_workers=LIST_WORKERS, journal=None, cache=True):
+    # List stage of the pipeline: yields one known-site record at a time, in
+    # list order. Pages are fetched concurrently, at most 2 * max_workers ahead
+    # of the page being consumed. With a journal, the list and every page are
+    # recorded as they arrive, and a resumed run replays them instead. With
+    # cache=False the search and pages always come from GlyGen, not the response cache.
+    listed = journal.get("list") if journal is not None else None
+    if listed is not None:
+        total_length, list_id, page_size = listed
+        logger.info(f"Resuming list {list_id}: {total_length} sites in pages of {page_size}")
+    else:
+        total_length, list_id = await engine.run(SEARCH_HOST, supersearch_search, cache)
+        if journal is not None:
+            journal.update(list=[total_length, list_id, page_size])
+    logger.info(f"Fetching {total_length} sites in pages of {page_size} with {max_workers} workers")
+
+    async def fetch_page(offset):
+        filtered_list = journal.list_page(offset) if journal is not None else None
+        if filtered_list is None:
+            filtered_list = await engine.run(SEARCH_HOST, fetch_list_page, list_id, offset, page_size, cache)
+            if journal is not None:
+                journal.put_list_page(offset, filtered_list)
+        return filtered_list
+
+    offsets = iter(range(1, total_length + 1, page_size))
+    pending = deque()
+
+    def submit(offset):
+        pending.append((offset, asyncio.ensure_future(fetch_page(offset))))
+
+    for offset in islice(offsets, 2 * max_workers):
+        submit(offset)
+    while pending:
+        offset, task = pending.popleft()
+        filtered_list = await task
+        for next_offset in islice(offsets, 1):
+            submit(next_offset)
+        for item in filtered_list:
+            yield extract_data_from_item(item)
+        logger.info(f"Processed up to offset: {offset + page_size}")
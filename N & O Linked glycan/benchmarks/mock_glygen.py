@@ -0,0 +1,281 @@
+"""Local stand-in for the GlyGen, EBI and GitHub endpoints the pipeline calls.
+
+Serves a synthetic proteome grown from backend/extracted_data.csv, with a
+configurable mean latency and error rate, and optionally a capacity above
+which requests get a 429 with a Retry-After, like a throttling API. Run it on its own and point main.py
+at it with the --api-override flags it prints:
+
+    python benchmarks/mock_glygen.py --scale 4 --latency 0.05 --error-rate 0.01 --port 8765
+"""
+import argparse
+import csv
+import functools
+import io
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_PATH = os.path.join(PROJECT_DIR, "backend", "extracted_data.csv")
+
+# Origins of every endpoint the pipeline uses; each is served under /<host>/ by the mock
+UPSTREAM_ORIGINS = [
+    "https://beta-api.glygen.org",
+    "https://api.glygen.org",
+    "https://www.ebi.ac.uk",
+    "https://data.glygen.org",
+    "https://github.com",
+]
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+RESIDUE_LETTERS = {"Ser": "S", "Thr": "T", "Asn": "N", "Tyr": "Y", "Lys": "K", "Trp": "W", "Cys": "C", "Arg": "R"}
+GLYCAN_POOL = 200
+ORGANISM = "Homo sapiens"
+TAX_ID = 9606
+
+
+def read_seed_sites(seed_path=SEED_PATH):
+    # accession -> [(site, amino acid, protein name, glycosylation type)], in file order
+    proteins = {}
+    with open(seed_path, newline='') as seed_file:
+        for row in csv.DictReader(seed_file):
+            proteins.setdefault(row["uniprotkb_canonical_ac"], []).append(
+                (int(row["site"]), row["amino_acid"], row["protein_name"], row["glycosylation_type"]))
+    return proteins
+
+
+def synthetic_accession(accession, copy):
+    # Copy 0 keeps the seed accession; the others get a distinct base, as the EBI lookup strips the isoform
+    if copy == 0:
+        return accession
+    base, _, isoform = accession.partition("-")
+    return f"{base}X{copy}-{isoform or '1'}"
+
+
+class SyntheticProteome:
+    """Known sites, proteins and glycans served by the mock, ``scale`` copies of the seed."""
+
+    def __init__(self, scale=1, seed=0, seed_path=SEED_PATH):
+        rng = random.Random(seed)
+        self.sites = []
+        self.proteins = {}
+        # The EBI lookup uses the accession without its isoform
+        self.by_base_accession = {}
+        # Base accessions whose EBI lookups, single or in a batch, fail at once with a 400
+        self.failing_domains = set()
+        self.glycans = [f"G{n:05d}BM" for n in range(GLYCAN_POOL)]
+        seed_proteins = read_seed_sites(seed_path)
+        for copy in range(scale):
+            for accession, known in seed_proteins.items():
+                self._add_protein(synthetic_accession(accession, copy), known, rng)
+
+    def _add_protein(self, accession, known, rng):
+        length = max(max(site for site, *_ in known) + 30, rng.randint(300, 1200))
+        residues = [rng.choice(AMINO_ACIDS) for _ in range(length)]
+        for site, amino_acid, *_ in known:
+            residues[site - 1] = RESIDUE_LETTERS.get(amino_acid, "S")
+        sequence = "".join(residues)
+        domain_start = rng.randint(1, length // 2)
+        self.proteins[accession] = {
+            "name": known[0][2],
+            "gene": f"GENE{len(self.proteins)}",
+            "sequence": sequence,
+            "glycan": rng.choice(self.glycans),
+            "domains": [(domain_start, min(length, domain_start + rng.randint(50, 300)), "Synthetic domain")],
+        }
+        self.by_base_accession[accession.split("-")[0]] = self.proteins[accession]
+        for site, amino_acid, protein_name, glycosylation_type in known:
+            self.sites.append({
+                "uniprot_canonical_ac": accession,
+                "protein_name": protein_name,
+                "start_pos": site,
+                "residue": amino_acid,
+                "glycosylation_type": glycosylation_type,
+                "up_seq": sequence[max(0, site - 11):site - 1],
+                "down_seq": sequence[site:site + 10],
+                "organism": ORGANISM,
+                "tax_id": TAX_ID,
+            })
+
+    @functools.cached_property
+    def go_csv(self):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["uniprotkb_canonical_ac", "go_term_id", "go_term_label", "go_term_category"])
+        for i, accession in enumerate(self.proteins):
+            writer.writerow([accession, f"GO_{i % 9000:07d}", "synthetic binding", "molecular_function"])
+            writer.writerow([accession, f"GO_{i % 7000:07d}", "synthetic process", "biological_process"])
+            writer.writerow([accession, f"GO_{i % 500:07d}", "synthetic membrane", "cellular_component"])
+        return out.getvalue()
+
+    @functools.cached_property
+    def redendmono_tsv(self):
+        lines = ["accession\tmonosaccharide"]
+        lines += [f"{ac}\t{'GlcNAc' if i % 2 else 'GalNAc'}" for i, ac in enumerate(self.glycans)]
+        return "\n".join(lines) + "\n"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real APIs
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle(None)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self._handle(json.loads(self.rfile.read(length) or b"null"))
+
+    def _handle(self, payload):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            throttled = server.capacity and server.in_flight > server.capacity
+            server.throttled += 1 if throttled else 0
+        try:
+            if throttled:
+                return self._send(429, b"", "text/plain", {"Retry-After": str(server.retry_after)})
+            self._respond(server, payload)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _respond(self, server, payload):
+        if server.latency > 0:
+            time.sleep(server.rng.expovariate(1 / server.latency))
+        if server.rng.random() < server.error_rate:
+            return self._send(503, b"", "text/plain")
+
+        url = urlparse(self.path)
+        host, _, path = url.path.lstrip("/").partition("/")
+        if host == "www.ebi.ac.uk" and server.proteome.failing_domains & set(ebi_accessions("/" + path, parse_qs(url.query))):
+            return self._send(400, b"", "text/plain")
+        body = route(server.proteome, host, "/" + path, payload, parse_qs(url.query))
+        if body is None:
+            return self._send(404, b"", "text/plain")
+        if isinstance(body, str):
+            return self._send(200, body.encode("utf-8"), "text/plain")
+        self._send(200, json.dumps(body).encode("utf-8"), "application/json")
+
+    def _send(self, status, content, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def domain_features(protein):
+    return [{"type": "DOMAIN", "begin": str(begin), "end": str(end), "description": desc}
+            for begin, end, desc in protein["domains"]]
+
+
+def ebi_accessions(path, query):
+    # Accessions asked for by an EBI proteins or features request
+    if path.startswith("/proteins/api/features"):
+        return query.get("accession", [""])[0].split(",")
+    return [path.rstrip("/").rsplit("/", 1)[-1]]
+
+
+def route(proteome, host, path, payload, query=None):
+    last = path.rstrip("/").rsplit("/", 1)[-1]
+    if host == "beta-api.glygen.org" and path.startswith("/supersearch/search"):
+        return {"results_summary": {"site": {"list_id": "benchmark"}}}
+    if host == "beta-api.glygen.org" and path.startswith("/supersearch/list"):
+        total_length = len(proteome.sites)
+        if "offset" not in payload:
+            return {"pagination": {"total_length": total_length}, "results": []}
+        offset, limit = payload["offset"], payload["limit"]
+        return {"pagination": {"total_length": total_length}, "results": proteome.sites[offset - 1:offset - 1 + limit]}
+    if host == "api.glygen.org" and path.startswith("/protein/detail/"):
+        protein = proteome.proteins.get(last)
+        if protein is None:
+            return None
+        return {
+            "gene_names": [{"resource": "UniProtKB", "type": "recommended", "name": protein["gene"]}],
+            "species": [{"name": ORGANISM}],
+            "sequence": {"sequence": protein["sequence"]},
+            "glycosylation": [{"glytoucan_ac": protein["glycan"]}],
+        }
+    if host == "www.ebi.ac.uk" and path.startswith("/proteins/api/proteins/"):
+        protein = proteome.by_base_accession.get(last)
+        if protein is None:
+            return None
+        return {"accession": last, "features": domain_features(protein)}
+    if host == "www.ebi.ac.uk" and path.startswith("/proteins/api/features"):
+        # Batch lookup: unknown accessions are left out of the answer, as by the EBI
+        accessions = ebi_accessions(path, query or {})
+        return [{"accession": accession, "features": domain_features(proteome.by_base_accession[accession])}
+                for accession in accessions if accession in proteome.by_base_accession]
+    if host == "beta-api.glygen.org" and path.startswith("/glycan/detail/"):
+        number = int(last[1:6]) if last[1:6].isdigit() else 0
+        glycan = {"classification": [{"subtype": {"name": "Core-fucosylated" if number % 3 == 0 else "Other"}}]}
+        if number % 4:
+            glycan["expression"] = [{"category": "tissue", "tissue": {"name": "liver", "namespace": "UBERON", "id": "0002107"}}]
+        return glycan
+    if host == "data.glygen.org" and path.endswith("_protein_go_annotation.csv"):
+        return proteome.go_csv
+    if host == "github.com" and path.endswith("redendmono.tsv"):
+        return proteome.redendmono_tsv
+    return None
+
+
+def start_mock_server(proteome, port=0, latency=0.0, error_rate=0.0, seed=0, capacity=0, retry_after=1):
+    # Serves in a daemon thread; returns the server and its base URL.
+    # With a capacity, requests beyond that many in flight get a 429 with a Retry-After
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    server.proteome = proteome
+    server.latency = latency
+    server.error_rate = error_rate
+    server.capacity = capacity
+    server.retry_after = retry_after
+    server.in_flight = 0
+    server.throttled = 0
+    server.lock = threading.Lock()
+    server.rng = random.Random(seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def override_args(base_url):
+    # main.py flags that send every upstream origin to the mock
+    args = []
+    for origin in UPSTREAM_ORIGINS:
+        args += ["--api-override", f"{origin}={base_url}/{urlparse(origin).netloc}"]
+    return args
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="mock glygen server")
+    parser.add_argument("--scale", type=int, default=1, help="copies of the seed proteome to serve")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean response latency in seconds (exponential)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument("--capacity", type=int, default=0, help="requests in flight beyond which a 429 is sent (0: unlimited)")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds of the Retry-After sent with a 429")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+
+    proteome = SyntheticProteome(options.scale, options.seed)
+    server, base_url = start_mock_server(proteome, options.port, options.latency, options.error_rate, options.seed,
+                                         options.capacity, options.retry_after)
+    print(f"serving {len(proteome.sites)} sites of {len(proteome.proteins)} proteins at {base_url}")
+    print("python3 main.py " + " ".join(override_args(base_url)))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Run main.py end to end against the local mock server at growing proteome sizes.
+
+Each size runs in a fresh working directory (so no cache is reused) and the
+throughput of every stage, the wall time and the peak memory are read back
+from the run report. Run from the project directory:
+
+    python benchmarks/pipeline_scaling.py --scales 1 2 4 8 --latency 0.02 --error-rate 0.001
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_glygen import PROJECT_DIR, SyntheticProteome, start_mock_server, override_args
+
+MAIN_PATH = os.path.join(PROJECT_DIR, "main.py")
+STAGES = ["list", "proteins", "glycans", "known_sites", "unknown_sites", "export"]
+
+
+def run_scale(scale, options):
+    proteome = SyntheticProteome(scale, options.seed)
+    server, base_url = start_mock_server(proteome, 0, options.latency, options.error_rate, options.seed,
+                                         options.capacity, options.retry_after)
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            args = [sys.executable, MAIN_PATH, "--no-http-cache", "-c", str(options.concurrency),
+                    "-w", str(options.workers)] + override_args(base_url) + options.main_args
+            start = time.perf_counter()
+            subprocess.run(args, cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+            wall_seconds = time.perf_counter() - start
+            with open(os.path.join(work_dir, "output", "run_report.json")) as report_file:
+                report = json.load(report_file)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {
+        "scale": scale,
+        "known_sites": len(proteome.sites),
+        "proteins": len(proteome.proteins),
+        "wall_seconds": wall_seconds,
+        "peak_rss_bytes": report["peak_rss_bytes"],
+        "peak_worker_rss_bytes": report["peak_worker_rss_bytes"],
+        "throttled": server.throttled,
+        "stages": report["stages"],
+        "hosts": report["hosts"],
+    }
+
+
+def print_table(results):
+    header = f"{'scale':>5} {'sites':>8} {'wall (s)':>9} {'RSS (MB)':>9} {'429s':>6}" + "".join(f" {stage + ' r/s':>17}" for stage in STAGES)
+    print(header)
+    for result in results:
+        line = f"{result['scale']:>5} {result['known_sites']:>8} {result['wall_seconds']:>9.2f} {result['peak_rss_bytes'] / 2**20:>9.1f} {result['throttled']:>6}"
+        for stage in STAGES:
+            rate = result["stages"].get(stage, {}).get("rows_per_second")
+            line += f" {rate:>17.0f}" if rate else f" {'-':>17}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="pipeline scaling benchmark")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 2, 4], help="copies of the seed proteome (~1000 known sites each)")
+    parser.add_argument("--latency", type=float, default=0.02, help="mean mock response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock responses that are 503s")
+    parser.add_argument("--capacity", type=int, default=0, help="mock requests in flight beyond which it answers 429 (0: unlimited)")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds of the Retry-After sent with a mock 429")
+    parser.add_argument("--concurrency", type=int, default=50, help="passed to main.py -c")
+    parser.add_argument("--workers", type=int, default=1, help="passed to main.py -w")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="also write the curves as JSON to this path")
+    parser.add_argument("main_args", nargs="*", help="extra main.py options, after --")
+    options = parser.parse_args()
+
+    results = []
+    for scale in options.scales:
+        results.append(run_scale(scale, options))
+        print(f"scale {scale}: {results[-1]['known_sites']} known sites in {results[-1]['wall_seconds']:.1f} s", flush=True)
+    print()
+    print_table(results)
+
+    if options.out:
+        with open(options.out, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
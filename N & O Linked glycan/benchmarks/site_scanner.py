@@ -0,0 +1,67 @@
+"""Benchmark the candidate-site scanner against the original per-residue scan.
+
+Run from the project directory:
+
+    python benchmarks/site_scanner.py --lengths 1000 10000 35000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.amino_acid_sites import scan_candidate_sites
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def legacy_positions_excluding_sites(fasta_seq, sites_to_exclude):
+    # The scan used by amino_acid_sites before scan_candidate_sites
+    motif_pattern = re.compile(r'N[^P](S|T)[^P]')
+    motifs = [(m.start(), m.group()) for m in motif_pattern.finditer(fasta_seq)]
+    residues = []
+    for residue in "STY":
+        residues.append([m.start() for m in re.finditer(residue, fasta_seq) if (m.start() + 1) not in sites_to_exclude and not any(m.start() in range(pos, pos + 4) for pos, _ in motifs)])
+    return residues[0], residues[1], residues[2], motifs
+
+
+def random_protein(length, rng):
+    return "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+def time_call(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="site scanner benchmark")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[1000, 5000, 35000], help="sequence lengths to scan (titin is ~35000 aa)")
+    parser.add_argument("--known-sites", type=int, default=50, help="known sites excluded per sequence")
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+
+    rng = random.Random(options.seed)
+    print(f"{'length':>8} {'legacy (s)':>12} {'scanner (s)':>12} {'speedup':>8}")
+    for length in options.lengths:
+        fasta_seq = random_protein(length, rng)
+        sites = np.array(sorted(rng.sample(range(1, length + 1), min(options.known_sites, length))))
+
+        legacy_time, expected = time_call(legacy_positions_excluding_sites, fasta_seq, sites)
+        scanner_time, result = time_call(scan_candidate_sites, fasta_seq, sites)
+        if result != expected:
+            raise SystemExit(f"scanner output differs from the legacy scan at length {length}")
+
+        print(f"{length:>8} {legacy_time:>12.4f} {scanner_time:>12.4f} {legacy_time / scanner_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark process startup: `main.py --help`, `import backend`, a request served from the response cache
+and a whole `main.py` run served from the caches.
+
+Every measurement runs in a fresh interpreter, so nothing is already imported.
+The cached run is primed against the local mock server, which is then shut
+down, so any request it still makes fails. Run from the project directory:
+
+    python benchmarks/startup.py --repeat 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, "benchmarks"))
+from backend.response_cache import ResponseCache
+from mock_glygen import SyntheticProteome, start_mock_server, override_args
+
+# Modules a startup should not pay for
+HEAVY_MODULES = ["requests", "pandas", "numpy", "pyarrow"]
+CACHED_URL = "https://api.glygen.org/protein/detail/P00533-1"
+
+IMPORT_BACKEND = f"""
+import sys, time, json
+start = time.perf_counter()
+import backend
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+CACHED_REQUEST = f"""
+import sys, time, json
+start = time.perf_counter()
+import backend
+from backend.http_client import post_json
+backend.configure_response_cache(sys.argv[1])
+post_json({CACHED_URL!r}, {{"uniprotkb_canonical_ac": "P00533-1"}})
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+class CachedResponse:
+    # Just enough of a requests.Response for ResponseCache.store
+    headers = {}
+    content = json.dumps({"sequence": {"sequence": "MRPSGTAGAALLALLAALCPASRA"}}).encode("utf-8")
+
+
+def run_wall(args):
+    # Wall time of a whole child process, interpreter start included
+    start = time.perf_counter()
+    subprocess.run(args, cwd=PROJECT_DIR, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def run_reported(args):
+    # Time the child measured itself, plus the heavy modules it ended up importing
+    output = subprocess.run(args, cwd=PROJECT_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def cached_runs(repeat):
+    # Wall time of main.py runs with warm caches and the upstream gone, plus the
+    # list stage's share and the requests the last run still sent
+    with tempfile.TemporaryDirectory() as work_dir:
+        server, base_url = start_mock_server(SyntheticProteome(1))
+        args = [sys.executable, os.path.join(PROJECT_DIR, "main.py")] + override_args(base_url)
+        subprocess.run(args, cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+        server.shutdown()
+        server.server_close()
+
+        wall, list_seconds = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run(args, cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+            wall.append(time.perf_counter() - start)
+            with open(os.path.join(work_dir, "output", "run_report.json")) as report_file:
+                report = json.load(report_file)
+            list_seconds.append(report["stages"]["list"]["seconds"])
+    requests_sent = sum(stats["requests"] for stats in report["hosts"].values())
+    return wall, list_seconds, requests_sent
+
+
+def summarize(name, seconds, loaded=None):
+    line = f"{name:<32} median {statistics.median(seconds) * 1000:>8.1f} ms   min {min(seconds) * 1000:>8.1f} ms"
+    if loaded is not None:
+        line += f"   heavy modules: {', '.join(loaded) or 'none'}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="startup benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh processes started per measurement")
+    options = parser.parse_args()
+
+    baseline = [run_wall([sys.executable, "-c", "pass"]) for _ in range(options.repeat)]
+    summarize("python -c pass (interpreter)", baseline)
+
+    help_times = [run_wall([sys.executable, "main.py", "--help"]) for _ in range(options.repeat)]
+    summarize("main.py --help (wall)", help_times)
+
+    reports = [run_reported([sys.executable, "-c", IMPORT_BACKEND]) for _ in range(options.repeat)]
+    summarize("import backend", [report["seconds"] for report in reports], reports[-1]["loaded"])
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ResponseCache(cache_dir)
+        cache.store(cache.key("POST", CACHED_URL, {"uniprotkb_canonical_ac": "P00533-1"}), CACHED_URL, CachedResponse())
+        reports = [run_reported([sys.executable, "-c", CACHED_REQUEST, cache_dir]) for _ in range(options.repeat)]
+    summarize("import + cached request", [report["seconds"] for report in reports], reports[-1]["loaded"])
+
+    wall, list_seconds, requests_sent = cached_runs(options.repeat)
+    summarize("main.py, all cached (wall)", wall)
+    summarize("  of which the list stage", list_seconds)
+    print(f"requests sent by the cached run: {requests_sent}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,6 @@
 import argparse
 import backend
 import logging
-import pandas as pd
 
 def setup_logger(log_path: str, name: str = "logger") -> logging.Logger:
     """Configures the root logger.
@@ -29,17 +28,48 @@ def setup_logger(log_path: str, name: str = "logger") -> logging.Logger:
 def main():
     parser = argparse.ArgumentParser(prog = "command line tool")
     parser.add_argument("-n", "--nocache", action= "store_false", help= "use the cache files or re-pull from the API")
+    parser.add_argument("--page-size", type= int, default= backend.PAGE_SIZE, help= "number of sites requested per supersearch list page")
+    parser.add_argument("--list-workers", type= int, default= backend.LIST_WORKERS, help= "number of supersearch list pages fetched concurrently")
+    parser.add_argument("-c", "--concurrency", type= int, default= backend.HOST_CONCURRENCY, help= "maximum in-flight requests per upstream host; each host starts lower and adapts to its latency and errors")
+    parser.add_argument("--rate-limit", type= float, default= backend.HOST_RATE_LIMIT, help= "maximum requests per second per upstream host (0: no limit)")
+    parser.add_argument("--http-cache-ttl", type= int, default= backend.HTTP_CACHE_TTL, help= "seconds a cached API response is reused before it is revalidated")
+    parser.add_argument("--no-http-cache", action= "store_true", help= "do not read or write the API response cache")
+    parser.add_argument("-i", "--incremental", action= "store_true", help= "only re-process sites that changed since the previous output")
+    parser.add_argument("-o", "--output-format", choices= backend.OUTPUT_FORMATS, default= "tsv", help= "format of the final dataset; parquet and arrow need pyarrow")
+    parser.add_argument("--partition-by", choices= backend.PARTITION_COLUMNS, help= "write the parquet/arrow dataset as one directory per organism or taxonomy id")
+    parser.add_argument("--features", action= "store_true", help= "also export integer-encoded peptide windows, labels and residue types as .npy files")
+    parser.add_argument("--window", type= int, default= backend.FEATURE_WINDOW, help= "residues on each side of the site in the exported feature windows")
+    parser.add_argument("--one-hot", action= "store_true", help= "also export the feature windows one-hot encoded")
+    parser.add_argument("--sample-ratio", type= backend.parse_sample_ratios, help= "unknown sites kept per known site for each residue, e.g. S=2,T=2,Y=1,N=1 (N: sequons); residues not listed are kept in full")
+    parser.add_argument("--sample-seed", type= int, default= backend.SAMPLE_SEED, help= "seed of the unknown-site sampling")
+    parser.add_argument("--stratify-organism", action= "store_true", help= "apply the sample ratios per organism instead of over the whole proteome")
+    parser.add_argument("--min-site-distance", type= int, default= 0, help= "drop unknown sites closer than this many residues to a known site")
+    parser.add_argument("-r", "--resume", action= "store_true", help= "continue an interrupted run from its journal instead of starting over")
+    parser.add_argument("--profile", action= "store_true", help= "write cProfile stats of every stage, including its fetch threads, to ./output/profiles (the -w worker processes are not profiled)")
+    parser.add_argument("--api-override", type= backend.parse_url_override, action= "append", default= [], metavar= "ORIGIN=URL", help= "send requests for an upstream origin to another URL, e.g. https://api.glygen.org=http://127.0.0.1:8765/api.glygen.org")
+    parser.add_argument("-w", "--workers", type= int, default= 1, help= "number of processes used to generate the unknown sites")
 
     options= parser.parse_args()
 
     logger = setup_logger("./logfile.log")
 
-    backend.all_supersearch_list_data(options.nocache, logger)
-    backend.get_all_protein_data(options.nocache, logger)
-    backend.get_glycan_data(logger)
-    df = pd.read_csv("./output/supersearch_results.tsv", delimiter="\t")
-    backend.sites_data(logger, df)
+    backend.configure_url_overrides(dict(options.api_override))
 
+    # With --nocache, cached responses are revalidated rather than trusted
+    backend.configure_response_cache(ttl=options.http_cache_ttl, revalidate=not options.nocache, enabled=not options.no_http_cache)
+
+    sampling = None
+    if options.sample_ratio or options.min_site_distance:
+        sampling = backend.NegativeSampling(options.sample_ratio, options.sample_seed,
+                                            options.stratify_organism, options.min_site_distance)
+
+    # list -> protein -> glycan -> output in one streaming pass, then the unknown sites.
+    # With --incremental the previous output is moved aside and diffed against the fresh list
+    backend.run_pipeline(logger, options.nocache, options.page_size, options.list_workers,
+                         options.concurrency, options.workers, options.incremental,
+                         options.output_format, options.partition_by,
+                         options.features, options.window, options.one_hot, sampling, options.resume,
+                         options.profile, options.rate_limit)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,13 @@
+import pytest
+
+from mock_run import PROJECT_DIR  # noqa: F401  (puts the project and benchmarks on sys.path)
+from mock_glygen import SyntheticProteome, start_mock_server
+
+
+@pytest.fixture
+def mock_server():
+    proteome = SyntheticProteome(1, 0)
+    server, base_url = start_mock_server(proteome)
+    yield proteome, base_url
+    server.shutdown()
+    server.server_close()
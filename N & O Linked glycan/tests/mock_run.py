@@ -0,0 +1,24 @@
+import csv
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, "benchmarks"))
+from mock_glygen import override_args
+
+MAIN_PATH = os.path.join(PROJECT_DIR, "main.py")
+
+
+def main_command(base_url, *args):
+    return [sys.executable, MAIN_PATH, *args] + override_args(base_url)
+
+
+def run_main(work_dir, base_url, *args):
+    subprocess.run(main_command(base_url, *args), cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+
+
+def output_rows(work_dir, accession):
+    with open(os.path.join(work_dir, "output", "supersearch_results.tsv"), newline='') as infile:
+        return [row for row in csv.DictReader(infile, delimiter='\t') if row["uniprotkb_canonical_ac"] == accession]
@@ -0,0 +1,33 @@
+import os
+import sqlite3
+
+from mock_run import run_main, output_rows
+from backend.domains import base_accession
+
+
+def cached_domains(work_dir, accession):
+    connection = sqlite3.connect(os.path.join(work_dir, "output", "cache.sqlite"))
+    try:
+        protein = connection.execute("SELECT 1 FROM proteins WHERE accession = ?", (accession,)).fetchone()
+        domains = connection.execute("SELECT 1 FROM domains WHERE accession = ?", (base_accession(accession),)).fetchone()
+    finally:
+        connection.close()
+    return protein is not None, domains is not None
+
+
+def test_failed_domain_lookup_keeps_protein_and_is_retried(tmp_path, mock_server):
+    proteome, base_url = mock_server
+    accession = proteome.sites[0]["uniprot_canonical_ac"]
+    proteome.failing_domains.add(base_accession(accession))
+
+    # The run completes: the protein is cached and its rows have empty domain columns
+    run_main(tmp_path, base_url, "--no-http-cache")
+    assert cached_domains(tmp_path, accession) == (True, False)
+    rows = output_rows(tmp_path, accession)
+    assert rows and not any(row["domain"] for row in rows)
+
+    # Once the EBI answers again, the next run fetches only the missing domains
+    proteome.failing_domains.clear()
+    run_main(tmp_path, base_url, "--no-http-cache")
+    assert cached_domains(tmp_path, accession) == (True, True)
+    assert any(row["domain"] for row in output_rows(tmp_path, accession))
@@ -0,0 +1,35 @@
+import os
+import sqlite3
+
+from mock_run import run_main, output_rows
+from backend.dataset import UNKNOWN_STATUS
+
+
+def test_incremental_refetches_changed_protein_past_response_cache(tmp_path, mock_server):
+    proteome, base_url = mock_server
+    run_main(tmp_path, base_url)
+
+    # The protein gets a new sequence and one more known site upstream
+    accession = proteome.sites[0]["uniprot_canonical_ac"]
+    protein = proteome.proteins[accession]
+    new_sequence = protein["sequence"][::-1]
+    protein["sequence"] = new_sequence
+    known_positions = {site["start_pos"] for site in proteome.sites if site["uniprot_canonical_ac"] == accession}
+    new_site = next(pos for pos in range(20, len(new_sequence)) if pos not in known_positions)
+    proteome.sites.insert(1, dict(proteome.sites[0], start_pos=new_site,
+                                  up_seq=new_sequence[new_site - 11:new_site - 1],
+                                  down_seq=new_sequence[new_site:new_site + 10]))
+
+    # Default options: the first run's GlyGen responses are still fresh in the response cache
+    run_main(tmp_path, base_url, "--incremental")
+
+    connection = sqlite3.connect(os.path.join(tmp_path, "output", "cache.sqlite"))
+    cached_sequence = connection.execute("SELECT data FROM proteins WHERE accession = ?", (accession,)).fetchone()[0]
+    connection.close()
+    assert new_sequence in cached_sequence
+
+    unknown_rows = [row for row in output_rows(tmp_path, accession) if row["status"] == UNKNOWN_STATUS]
+    assert unknown_rows
+    for row in unknown_rows:
+        pos = int(row["site"]) - 1
+        assert row["peptide_seq_ten_after"] == new_sequence[pos + 1:pos + 11]
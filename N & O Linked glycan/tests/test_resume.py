@@ -0,0 +1,61 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import time
+
+import pytest
+
+from mock_run import main_command, run_main
+from mock_glygen import SyntheticProteome, start_mock_server
+from backend.journal import JOURNAL_CHECKPOINT_ROWS
+
+
+def committed_rows(work_dir):
+    path = os.path.join(work_dir, "output", "journal.sqlite")
+    if not os.path.isfile(path):
+        return 0
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'known_rows'").fetchone()
+    except sqlite3.OperationalError:
+        row = None  # not created yet
+    finally:
+        connection.close()
+    return int(row[0]) if row else 0
+
+
+def read_output(work_dir):
+    with open(os.path.join(work_dir, "output", "supersearch_results.tsv")) as infile:
+        return infile.read()
+
+
+@pytest.fixture
+def slow_mock_server():
+    # Two row checkpoints' worth of known sites, served slowly enough that a run
+    # is still in the known-site stage after its first commit
+    server, base_url = start_mock_server(SyntheticProteome(2, 0), latency=0.01)
+    yield base_url
+    server.shutdown()
+    server.server_close()
+
+
+def test_resume_after_kill_at_row_checkpoint(tmp_path, slow_mock_server):
+    base_url = slow_mock_server
+    options = ["--no-http-cache", "-w", "2"]
+    reference_dir, resumed_dir = tmp_path / "reference", tmp_path / "resumed"
+    reference_dir.mkdir()
+    resumed_dir.mkdir()
+    run_main(reference_dir, base_url, *options)
+
+    process = subprocess.Popen(main_command(base_url, *options), cwd=resumed_dir, stdout=subprocess.DEVNULL)
+    try:
+        while committed_rows(resumed_dir) < JOURNAL_CHECKPOINT_ROWS and process.poll() is None:
+            time.sleep(0.01)
+    finally:
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+    assert committed_rows(resumed_dir) >= JOURNAL_CHECKPOINT_ROWS
+
+    run_main(resumed_dir, base_url, "--resume", *options)
+    assert read_output(resumed_dir) == read_output(reference_dir)